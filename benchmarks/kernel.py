@@ -0,0 +1,127 @@
+"""
+Measures latency and throughput of the hot paths of an installed zsh kernel.
+
+    python -m benchmarks.kernel [--output FILE] [--runs N] [--size MB] [--streams pty|pipes]
+
+Drives a real kernel through `jupyter_client` and writes the results as JSON,
+so runs can be compared over time:
+- p50 and p99 latency of a trivial `execute_request` until the kernel is idle again
+- MB/s and messages/s of the stream output of a cell printing `--size` MB of lines
+- p50 and p99 latency of `complete_request`, `inspect_request` and `is_complete_request`
+- startup time as measured by `benchmarks.startup`
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import time
+from typing import Callable
+
+import jupyter_client
+
+from .startup import measure as measure_startup
+
+def percentiles(samples: list[float]) -> dict:
+    """p50 and p99 of `samples` in milliseconds."""
+    p99 = statistics.quantiles(samples, n = 100, method = "inclusive")[98] if len(samples) > 1 else samples[0]
+    return {
+        "p50_ms": 1000 * statistics.median(samples),
+        "p99_ms": 1000 * p99,
+        "runs": len(samples),
+    }
+
+def timed(request: Callable[[], dict], runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        reply = request()
+        samples.append(time.perf_counter() - start)
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(f"request failed: {reply['content']}")
+    return percentiles(samples)
+
+def throughput(kc: jupyter_client.BlockingKernelClient, size: int, timeout: float, lines: bool = True) -> dict:
+    """Stream output of a cell printing `size` bytes of 64 byte lines or a single line."""
+    messages = 0
+    received = 0
+
+    def count(msg):
+        nonlocal messages, received
+        if msg["msg_type"] == "stream":
+            messages += 1
+            received += len(msg["content"]["text"].encode())
+
+    start = time.perf_counter()
+    code = f"yes {'x' * 63} | head -c {size}" if lines else f"head -c {size} /dev/zero | tr '\\0' x"
+    kc.execute_interactive(code, timeout = timeout, output_hook = count)
+    elapsed = time.perf_counter() - start
+    return {
+        "bytes": received,
+        "messages": messages,
+        "seconds": elapsed,
+        "mb_per_s": received / elapsed / 1e6,
+        "messages_per_s": messages / elapsed,
+    }
+
+def run(kernel_name: str, runs: int, size: int, env: dict, timeout: float) -> dict:
+    km = jupyter_client.KernelManager(kernel_name = kernel_name)
+    km.start_kernel(env = {**os.environ, **env})
+    kc = km.client()
+    kc.start_channels()
+    try:
+        kernel_info = kc.kernel_info(reply = True, timeout = timeout)["content"]
+        quiet = dict(timeout = timeout, output_hook = lambda msg: None)
+        kc.execute_interactive("true", **quiet)  # the shell has started
+        results = {
+            "kernel": {
+                "implementation_version": kernel_info["implementation_version"],
+                "language_version": kernel_info["language_info"]["version"],
+            },
+            "execute": timed(lambda: kc.execute_interactive("true", **quiet), runs),
+            "output": throughput(kc, size, timeout),
+            "long_line_output": throughput(kc, size, timeout, lines = False),
+            "complete": timed(lambda: kc.complete("ech", 3, reply = True, timeout = timeout), runs),
+            "inspect": timed(lambda: kc.inspect("ls", 2, reply = True, timeout = timeout), runs),
+            "is_complete": timed(lambda: kc.is_complete("for x in 1 2; do", reply = True, timeout = timeout), runs),
+        }
+    finally:
+        kc.stop_channels()
+        km.shutdown_kernel(now = True)
+    startup = [measure_startup(kernel_name, timeout, env) for _ in range(max(1, runs // 20))]
+    results["startup"] = {
+        key: percentiles([x[key] for x in startup])
+        for key in ("kernel_info_reply", "first_cell")
+    }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--kernel", default = "zsh", help = "kernel name. default: %(default)s")
+    parser.add_argument("--runs", type = int, default = 100, help = "requests per measurement. default: %(default)s")
+    parser.add_argument("--size", type = float, default = 64, help = "MB of output. default: %(default)s")
+    parser.add_argument("--streams", choices = ["pty", "pipes"], default = "pty", help = "default: %(default)s")
+    parser.add_argument("--timeout", type = float, default = 600, help = "seconds. default: %(default)s")
+    parser.add_argument("--output", help = "JSON file. default: benchmark-<time>.json")
+    args = parser.parse_args()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    env = {
+        "ZSH_JUPYTER_KERNEL_STREAMS": args.streams,
+        "ZSH_JUPYTER_KERNEL_OUTPUT_LIMIT": "0",  # all output is sent
+    }
+    results = {
+        "time": now.isoformat(timespec = "seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "parameters": {"runs": args.runs, "size": int(args.size * 1e6), "streams": args.streams},
+        **run(args.kernel, args.runs, int(args.size * 1e6), env, args.timeout),
+    }
+    output_path = args.output or f"benchmark-{now:%Y%m%dT%H%M%SZ}.json"
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent = 4)
+    print(json.dumps(results, indent = 4))
+
+if __name__ == "__main__":
+    main()
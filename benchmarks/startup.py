@@ -0,0 +1,72 @@
+"""
+Measures how long an installed zsh kernel takes to start.
+
+    python -m benchmarks.startup [--runs N] [--kernel NAME] [--imports]
+
+For each run a new kernel is started and the time to the first `kernel_info_reply`
+and to the reply of the first executed cell is reported. `--imports` additionally
+lists the slowest imports of the kernel module as reported by `python -X importtime`.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import jupyter_client
+
+def measure(kernel_name: str, timeout: float, env: dict = None) -> dict:
+    """Seconds from starting a kernel to its first replies. `env` is added to the environment of the kernel."""
+    km = jupyter_client.KernelManager(kernel_name = kernel_name)
+    start = time.perf_counter()
+    km.start_kernel(env = {**os.environ, **(env or {})})
+    kc = km.client()
+    kc.start_channels()
+    try:
+        kc.wait_for_ready(timeout = timeout)  # sends kernel_info_requests until one is answered
+        kernel_info = time.perf_counter() - start
+        reply = kc.execute_interactive("true", timeout = timeout, output_hook = lambda msg: None)
+        first_cell = time.perf_counter() - start
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(f"first cell failed: {reply['content']}")
+    finally:
+        kc.stop_channels()
+        km.shutdown_kernel(now = True)
+    return {"kernel_info_reply": kernel_info, "first_cell": first_cell}
+
+def summarize(samples: list[float]) -> str:
+    return "median {:7.1f} ms  min {:7.1f} ms  max {:7.1f} ms".format(
+        *(1000 * x for x in (statistics.median(samples), min(samples), max(samples))))
+
+def slowest_imports(module: str, n: int) -> list[tuple[int, str]]:
+    """The `n` imports with the largest cumulative time in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output = True, text = True, check = True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imports.append((int(fields[1]), fields[2].rstrip()))
+    return sorted(imports, reverse = True)[:n]
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--kernel", default = "zsh", help = "kernel name. default: %(default)s")
+    parser.add_argument("--runs", type = int, default = 5, help = "default: %(default)s")
+    parser.add_argument("--timeout", type = float, default = 60, help = "seconds. default: %(default)s")
+    parser.add_argument("--imports", action = "store_true", help = "list the slowest imports")
+    args = parser.parse_args()
+    if args.imports:
+        for (us, name) in slowest_imports("zsh_jupyter_kernel.kernel", 20):
+            print(f"{us / 1000:9.1f} ms {name}")
+        print()
+    runs = [measure(args.kernel, args.timeout) for _ in range(args.runs)]
+    for key in ("kernel_info_reply", "first_cell"):
+        print(f"{key:>18}: {summarize([run[key] for run in runs])}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import time
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.cache import LRUCache
+
+class cache_test(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        c = LRUCache(maxsize = 2)
+        c.put("a", 1)
+        c.put("b", 2)
+        c.get("a")
+        c.put("c", 3)
+        self.assertEqual(c.get("a"), 1)
+        self.assertIsNone(c.get("b"))
+        self.assertEqual(c.get("c"), 3)
+
+    def test_evicts_by_size(self):
+        c = LRUCache(maxsize = 10, maxbytes = 5, sizeof = len)
+        c.put("a", "xxx")
+        c.put("b", "yy")
+        c.put("c", "z")
+        self.assertIsNone(c.get("a"))
+        self.assertEqual(c.nbytes, 3)
+        c.put("d", "too long")
+        self.assertIsNone(c.get("d"))
+        self.assertEqual(len(c), 2)
+
+    def test_expires(self):
+        c = LRUCache(ttl = 0.01)
+        c.put("a", 1)
+        time.sleep(0.02)
+        self.assertIsNone(c.get("a"))
+        self.assertEqual(len(c), 0)
+
+    def test_evict_if(self):
+        c = LRUCache()
+        for k in [("ls ", 1), ("git ", 1), ("ls ", 2)]:
+            c.put(k, k)
+        self.assertEqual(c.evict_if(lambda key: key[1] != 2), 2)
+        self.assertEqual(c.get(("ls ", 2)), ("ls ", 2))
+        self.assertEqual(len(c), 1)
+
+
+if __name__ == '__main__':
+    main()
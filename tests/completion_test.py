@@ -0,0 +1,38 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase, main, skipUnless
+
+from zsh_jupyter_kernel.completion import ShellState
+
+class completion_test(TestCase):
+
+    def test_parse(self):
+        fields = ["/tmp", "/bin:/usr/bin", "/fn", "42:1700000000"]
+        output = "[1]  + done       sleep 1\r\n" + ShellState.marker + "\0".join(fields)
+        (before, state) = ShellState.parse(output)
+        self.assertEqual(before, "[1]  + done       sleep 1\r\n")
+        self.assertEqual(state, ShellState("/tmp", "/bin:/usr/bin", "/fn", "42:1700000000"))
+        self.assertEqual(ShellState.parse(ShellState.marker + "/tmp"), ("", ShellState("/tmp")))
+
+    @skipUnless(shutil.which("zsh"), "needs zsh")
+    def test_hash_generation(self):
+        with tempfile.TemporaryDirectory() as bin_path:
+            def query():
+                output = subprocess.run(["zsh", "-f", "-c", f"path=({bin_path}); " + ShellState.query],
+                    capture_output = True, text = True, check = True).stdout
+                return ShellState.parse(output)
+            (before, state) = query()
+            self.assertEqual(before, "")
+            self.assertEqual(state.path, bin_path)
+            os.utime(bin_path, (0, 0))
+            (_, state) = query()
+            with open(os.path.join(bin_path, "tool"), "w"):
+                pass
+            os.chmod(os.path.join(bin_path, "tool"), 0o755)
+            (_, changed) = query()
+            self.assertNotEqual(changed.hash_generation, state.hash_generation)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import base64
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.display import DisplayFiles
+
+class display_test(TestCase):
+
+    def test_bundles(self):
+        with TemporaryDirectory() as d:
+            png = Path(d, "plot.png")
+            png.write_bytes(b"\x89PNG\r\n\x1a\n" + bytes(range(256)))
+            svg = Path(d, "plot.svg")
+            svg.write_text("<svg/>")
+            data = Path(d, "data")
+            data.write_text('{"a": 1}')
+            files = DisplayFiles(maxsize = 1 << 20, cache_maxbytes = 1 << 20)
+            bundle = files.bundle(str(png))
+            self.assertEqual(base64.b64decode(bundle["image/png"]), png.read_bytes())
+            self.assertEqual(bundle["text/plain"], "<image/png plot.png>")
+            self.assertEqual(files.bundle(str(svg))["image/svg+xml"], "<svg/>")
+            self.assertEqual(files.bundle(str(data), "application/json")["application/json"], {"a": 1})
+            self.assertEqual(files.bundle(str(data)), {"text/plain": '{"a": 1}'})
+
+    def test_cache_and_limits(self):
+        with TemporaryDirectory() as d:
+            path = Path(d, "page.html")
+            path.write_text("<b>1</b>")
+            files = DisplayFiles(maxsize = 10, cache_maxbytes = 1 << 20)
+            self.assertIs(files.bundle(str(path)), files.bundle(str(path)))
+            path.write_text("<b>2</b>")
+            os.utime(path, ns = (0, 1))  # a changed file is read again
+            self.assertEqual(files.bundle(str(path))["text/html"], "<b>2</b>")
+            path.write_text("<b>large</b>")
+            self.assertRaises(ValueError, files.bundle, str(path))
+            self.assertRaises(OSError, files.bundle, str(Path(d, "missing.png")))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import threading
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.history import History
+
+class history_test(TestCase):
+
+    def test_sessions(self):
+        with TemporaryDirectory() as d:
+            path = Path(d, "history.sqlite")
+            first = History(path)
+            first.add(1, "print one")
+            first.add(2, "ls -l")
+            first.close()
+            history = History(path)
+            self.assertEqual(history.session, first.session + 1)
+            history.add(1, "print two")
+            history.add(2, "ls -l")
+            self.assertEqual(history.tail(3), [
+                (first.session, 2, "ls -l"),
+                (history.session, 1, "print two"),
+                (history.session, 2, "ls -l"),
+            ])
+            self.assertEqual([x[2] for x in history.tail(10, unique = True)], ["print one", "print two", "ls -l"])
+            self.assertEqual(history.range(0, 2, None), [(history.session, 2, "ls -l")])
+            self.assertEqual(history.range(-1, 1, 2), [(first.session, 1, "print one")])
+            self.assertEqual(history.range(first.session, 1, None), [
+                (first.session, 1, "print one"),
+                (first.session, 2, "ls -l"),
+            ])
+            history.close()
+
+    def test_search(self):
+        with TemporaryDirectory() as d:
+            history = History(Path(d, "history.sqlite"))
+            for (i, source) in enumerate(["git status", "git log", "print 'git'", "git status", "ls"], 1):
+                history.add(i, source)
+            self.assertEqual([x[1] for x in history.search("git*")], [1, 2, 4])
+            self.assertEqual([x[1] for x in history.search("git*", n = 1)], [4])
+            self.assertEqual([x[1] for x in history.search("git*", unique = True)], [2, 4])
+            self.assertEqual([x[1] for x in history.search("*git*")], [1, 2, 3, 4])
+            self.assertEqual([x[1] for x in history.search("git st?t[u]s")], [1, 4])
+            self.assertEqual([x[1] for x in history.search("l?")], [5])
+            self.assertEqual(history.search("nothing*"), [])
+            history.close()
+
+    def test_without_index(self):
+        with TemporaryDirectory() as d:
+            history = History(Path(d, "history.sqlite"))
+            history.fts = False
+            history.add(1, "git status")
+            history.add(2, "ls")
+            self.assertEqual([x[1] for x in history.search("*status")], [1])
+            history.close()
+
+    def test_close_from_another_thread(self):
+        with TemporaryDirectory() as d:
+            history = History(Path(d, "history.sqlite"))
+            history.add(1, "print one")
+            errors = []
+
+            def close():
+                try:
+                    history.close()
+                except Exception as e:
+                    errors.append(e)
+
+            closer = threading.Thread(target = close)
+            closer.start()
+            closer.join()
+            self.assertEqual(errors, [])
+            history = History(Path(d, "history.sqlite"))
+            self.assertEqual(history.tail(1)[0][2], "print one")
+            history.close()
+
+
+if __name__ == '__main__':
+    main()
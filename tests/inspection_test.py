@@ -0,0 +1,40 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.inspection import ManPages
+
+class inspection_test(TestCase):
+
+    def test_memory_and_disk(self):
+        with TemporaryDirectory() as d:
+            pages = ManPages("echo page of {}", width = 80, maxbytes = 1 << 20, disk_dir = d)
+            self.assertIn("page of grep", pages.render("grep"))
+            self.assertEqual(len(pages.memory), 1)
+            pages.cmd = "false {}"  # served from the cache from now on
+            self.assertIn("page of grep", pages.render("grep"))
+            restarted = ManPages("false {}", width = 80, maxbytes = 1 << 20, disk_dir = d)
+            self.assertIn("page of grep", restarted.render("grep"))
+            self.assertIsNone(restarted.render("grep"[::-1]))
+
+    def test_prune(self):
+        with TemporaryDirectory() as d:
+            pages = ManPages("echo page of {}", width = 80, maxbytes = 1 << 20, disk_dir = d, disk_ttl = 60)
+            pages.render("grep")
+            pages.render("find")
+            (old, new) = sorted(Path(d).iterdir())
+            os.utime(old, (0, 0))
+            pages.prune()
+            self.assertEqual(list(Path(d).iterdir()), [new])
+
+    def test_keyed_on_width(self):
+        pages = ManPages("echo {}", width = 80, maxbytes = 1 << 20)
+        pages.render("find")
+        pages.width = 120
+        pages.render("find")
+        self.assertEqual(len(pages.memory), 2)
+
+
+if __name__ == '__main__':
+    main()
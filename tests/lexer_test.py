@@ -0,0 +1,61 @@
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.lexer import TokenIndex, unquote
+
+class lexer_test(TestCase):
+
+    def words(self, code):
+        index = TokenIndex(code)
+        return [(index.text(t), t.kind) for t in index.tokens]
+
+    def test_command_position(self):
+        self.assertEqual(self.words("A=1 make -j4 | grep -v x && if true; then man ls >out; fi"), [
+            ("A=1", "assignment"), ("make", "command"), ("-j4", "argument"),
+            ("grep", "command"), ("-v", "argument"), ("x", "argument"),
+            ("if", "reserved"), ("true", "command"),
+            ("then", "reserved"), ("man", "command"), ("ls", "argument"), ("out", "redirect"),
+            ("fi", "reserved"),
+        ])
+
+    def test_quotes_and_substitutions(self):
+        self.assertEqual(self.words("""print "a $(date +%s) 'b'" '$(no)' `uname` ${x:-$(id)} $((1 + 2))"""), [
+            ("print", "command"),
+            ('"a $(date +%s) \'b\'"', "argument"), ("date", "command"), ("+%s", "argument"),
+            ("'$(no)'", "argument"),
+            ("`uname`", "argument"), ("uname", "command"),
+            ("${x:-$(id)}", "argument"), ("id", "command"),
+            ("$((1 + 2))", "argument"),
+        ])
+
+    def test_comments_and_heredocs(self):
+        self.assertEqual(self.words("cat <<-EOF # not ls\n\tno command\n\tEOF\nwc"), [
+            ("cat", "command"), ("EOF", "redirect"), ("wc", "command"),
+        ])
+
+    def test_at(self):
+        index = TokenIndex("foo $(bar baz) qux")
+        words = [index.text(t) if (t := index.at(pos)) else None for pos in range(19)]
+        self.assertEqual(words, [
+            *["foo"] * 4, *["$(bar baz)"] * 2, *["bar"] * 4, *["baz"] * 4, "$(bar baz)", *["qux"] * 4,
+        ])
+        self.assertEqual(index.text(index.command_of(index.at(11))), "bar")
+        self.assertIsNone(TokenIndex("ls  -l").at(3))
+
+    def test_word_start(self):
+        index = TokenIndex('cat "some fi')
+        self.assertEqual(index.word_start(index.at(12), 12), 5)
+        index = TokenIndex('cat "some file" x')
+        self.assertEqual(index.word_start(index.at(15), 15), 4)
+
+    def test_deep_nesting(self):
+        for (opener, closer) in [("$(", ")"), ("\"$(", ")\""), ("${", "}")]:
+            code = "echo " + opener * 5000 + "x" + closer * 5000 + " y"
+            index = TokenIndex(code)
+            self.assertEqual(index.text(index.at(len(code))), "y")
+
+    def test_unquote(self):
+        self.assertEqual(unquote(r"""'l'"s"\-"""), "ls-")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import logging
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.log import LogWriter, SamplingFilter, start_logging
+
+class log_test(TestCase):
+
+    def record(self, category = None):
+        record = logging.LogRecord("test", logging.DEBUG, __file__, 0, "message", (), None)
+        if category is not None:
+            record.category = category
+        return record
+
+    def test_sampling(self):
+        f = SamplingFilter({"output": 0.25, "noise": 0})
+        passed = [f.filter(self.record("output")) for _ in range(8)]
+        self.assertEqual(passed, [True, False, False, False] * 2)
+        self.assertFalse(f.filter(self.record("noise")))
+        self.assertTrue(f.filter(self.record()))
+        self.assertTrue(f.filter(self.record("request")))
+
+    def test_queued_and_rotated(self):
+        with TemporaryDirectory() as d:
+            logger = logging.getLogger("log_test.kernel")
+            pexpect_logger = logging.getLogger("log_test.pexpect")
+            listener = start_logging(logger,
+                file_path = str(Path(d, "kernel.log")),
+                level = "DEBUG",
+                formatter = "%(levelname)s %(message)s",
+                pexpect_logger = pexpect_logger,
+                pexpect_file_path = str(Path(d, "pexpect.log")),
+                max_bytes = 1000,
+                backup_count = 1,
+                sampling = {"output": 0.5},
+            )
+            try:
+                for i in range(4):
+                    logger.debug("output %s", i, extra = {"category": "output"})
+                LogWriter(pexpect_logger).write("echo 1\r\n")
+                for _ in range(100):
+                    logger.info("%s", "x" * 50)
+            finally:
+                listener.stop()
+                for name in (logger, pexpect_logger):
+                    name.handlers.clear()
+            self.assertEqual(Path(d, "pexpect.log").read_bytes(), b"echo 1\r\n")
+            self.assertEqual(sorted(p.name for p in Path(d).iterdir()),
+                ["kernel.log", "kernel.log.1", "pexpect.log"])
+            self.assertLessEqual(Path(d, "kernel.log").stat().st_size, 1000)
+
+
+if __name__ == '__main__':
+    main()
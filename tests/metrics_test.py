@@ -0,0 +1,50 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.metrics import Histogram, Metrics, timed
+
+class metrics_test(TestCase):
+
+    def test_histogram(self):
+        h = Histogram()
+        for ms in (0.1, 0.7, 3, 3, 2000):
+            h.observe(ms / 1000)
+        self.assertEqual(h.count, 5)
+        self.assertEqual(h.quantile(0.5), 0.004)
+        self.assertEqual(h.quantile(1), 2.048)
+        h.observe(3600)
+        self.assertEqual(h.quantile(1), float("inf"))
+
+    def test_prometheus(self):
+        m = Metrics(prefix = "k")
+        m.observe("execute", 0.002)
+        m.count("messages_sent:stream", 2)
+        m.count("messages_sent:error")
+        m.count("expect_iterations", 3)
+        text = m.prometheus({"pid": "1"})
+        self.assertIn('k_execute_seconds_bucket{pid="1",le="0.002"} 1', text)
+        self.assertIn('k_execute_seconds_bucket{pid="1",le="+Inf"} 1', text)
+        self.assertIn('k_execute_seconds_count{pid="1"} 1', text)
+        self.assertIn('k_messages_sent_total{pid="1",type="stream"} 2', text)
+        self.assertIn('k_expect_iterations_total{pid="1"} 3', text)
+        self.assertEqual(text.count("# TYPE k_messages_sent_total counter"), 1)
+        with TemporaryDirectory() as d:
+            path = Path(d, "k.prom")
+            m.write_textfile(path)
+            self.assertEqual([p.name for p in Path(d).iterdir()], ["k.prom"])
+
+    def test_timed(self):
+        class Handler:
+            metrics = Metrics()
+            @timed("handle")
+            def handle(self, x):
+                return x
+        handler = Handler()
+        self.assertEqual(handler.handle(1), 1)
+        snapshot = handler.metrics.snapshot()
+        self.assertEqual(snapshot["histograms"]["handle"]["count"], 1)
+
+
+if __name__ == '__main__':
+    main()
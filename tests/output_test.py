@@ -0,0 +1,197 @@
+import re
+import time
+import tracemalloc
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.output import OutputBudget, OutputCoalescer, ProgressCollapser, read_until
+
+class output_test(TestCase):
+
+    def setUp(self):
+        self.sent = []
+
+    def send(self, name, text):
+        self.sent.append((name, text))
+
+    def test_batches_by_size(self):
+        o = OutputCoalescer(self.send, maxsize = 10, interval = 60)
+        for _ in range(25):
+            o.write("stdout", "x\n")
+        self.assertEqual(len(self.sent), 5)
+        o.flush()
+        self.assertEqual("".join(t for _, t in self.sent), "x\n" * 25)
+
+    def test_batches_by_time(self):
+        o = OutputCoalescer(self.send, maxsize = 1 << 20, interval = 0.01)
+        o.write("stdout", "a")
+        self.assertEqual(self.sent, [])
+        self.assertGreater(o.timeout(), 0)
+        time.sleep(0.02)
+        self.assertEqual(o.timeout(), 0)
+        o.write("stdout", "b")
+        self.assertEqual(self.sent, [("stdout", "ab")])
+        self.assertIsNone(o.timeout())
+
+    def test_keeps_stream_order(self):
+        o = OutputCoalescer(self.send, maxsize = 1 << 20, interval = 60)
+        o.write("stdout", "1")
+        o.write("stderr", "2")
+        o.write("stdout", "3")
+        o.flush()
+        self.assertEqual(self.sent, [("stdout", "1"), ("stderr", "2"), ("stdout", "3")])
+
+    def test_budget_spills_and_keeps_tail(self):
+        with TemporaryDirectory() as d:
+            b = OutputBudget(self.send, maxsize = 10, tail_size = 4, spill_dir = d)
+            b.start("1")
+            for i in range(100):
+                b.write("stdout", f"{i % 10}")
+            b.finish()
+            stdout = "".join(t for n, t in self.sent if n == "stdout")
+            self.assertEqual(stdout, "0123456789" + "6789")
+            self.assertTrue(any("100 characters in total" in t for n, t in self.sent if n == "stderr"))
+            self.assertEqual(Path(d, "1.txt").read_text(), "0123456789" * 10)
+
+    def test_budget_within_limit(self):
+        with TemporaryDirectory() as d:
+            b = OutputBudget(self.send, maxsize = 10, tail_size = 4, spill_dir = d)
+            b.start("1")
+            b.write("stdout", "0123456789")
+            b.finish()
+            b.start("2")
+            b.write("stdout", "0123456789")
+            b.finish()
+            self.assertEqual(self.sent, [("stdout", "0123456789")] * 2)
+            self.assertEqual(list(Path(d).iterdir()), [])
+
+    def display(self, display_id, text, update):
+        self.sent.append(("display" if not update else "update", text))
+
+    def test_progress_collapses_redraws(self):
+        p = ProgressCollapser(self.send, self.display, interval = 60, maxrows = 64)
+        p.write("stdout", "downloading\r\n  0%")
+        for i in range(1, 101):
+            p.write("stdout", f"\r{i:3}%")
+        p.write("stdout", "\r\ndone\r\n")
+        p.finish()
+        self.assertEqual(self.sent, [
+            ("stdout", "downloading\r\n"),
+            ("display", "  1%"),
+            ("update", "100%\ndone\n"),
+        ])
+
+    def test_progress_cursor_up(self):
+        p = ProgressCollapser(self.send, self.display, interval = 0, maxrows = 64)
+        p.write("stderr", "a: 0%\nb: 0%\n")
+        p.write("stderr", "\x1b[2A\x1b[2Ka: 100%\n\x1b[1B")
+        p.write("stderr", "\x1b[1A\x1b[2Kb: 100%\n")
+        p.finish()
+        self.assertEqual(self.sent[0], ("stderr", "a: 0%\nb: 0%\n"))
+        self.assertEqual(self.sent[-1], ("update", "a: 100%\nb: 100%\n"))
+
+    def test_progress_passes_other_output(self):
+        p = ProgressCollapser(self.send, self.display, interval = 0.01, maxrows = 2)
+        p.write("stdout", "line\nprompt? ")
+        self.assertEqual(self.sent, [("stdout", "line\n")])
+        self.assertGreater(p.timeout(), 0)
+        time.sleep(0.02)
+        p.flush()
+        self.assertEqual(self.sent, [("stdout", "line\n"), ("stdout", "prompt? ")])
+        self.assertIsNone(p.timeout())
+        self.sent.clear()
+        p.write("stdout", "x\ry\n1\n2\n3\n")
+        p.write("stdout", "4\n")
+        p.finish()
+        self.assertEqual(self.sent, [("display", "y\n1\n2\n3\n"), ("stdout", "4\n")])
+
+    def test_progress_bounds_screen(self):
+        p = ProgressCollapser(self.send, self.display, interval = 0, maxrows = 64, maxcols = 20, maxsize = 100)
+        p.write("stdout", "0%\r")
+        for _ in range(50):
+            p.write("stdout", "x" * 10)
+        p.finish()
+        displays = [text for (kind, text) in self.sent if kind in ("display", "update")]
+        self.assertLessEqual(sum(map(len, displays)), 100)
+        self.assertEqual("".join(text for (kind, text) in self.sent if kind == "stdout"), "x" * 470)
+        self.sent.clear()
+        p.write("stdout", "1%\r2%\n")
+        p.finish()
+        self.assertEqual(self.sent, [("display", "2%\n")])
+
+    def test_progress_refused_display(self):
+        def refuse(display_id, text, update):
+            self.sent.append(("refused", text))
+            return False
+
+        p = ProgressCollapser(self.send, refuse, interval = 0, maxrows = 64)
+        p.write("stdout", "1%\r2%")
+        p.write("stdout", "\r3%\n")
+        p.finish()
+        self.assertEqual(self.sent, [("refused", "2%"), ("stdout", "2%"), ("stdout", "\r3%\n")])
+
+    def test_progress_rows_of_previous_cell(self):
+        p = ProgressCollapser(self.send, self.display, interval = 0, maxrows = 64)
+        p.write("stdout", "a\n")
+        p.finish()
+        p.write("stdout", "\x1b[1Ab\n")
+        p.finish()
+        self.assertEqual(self.sent[-1], ("display", "b\n"))
+
+    def test_budget_allows_displays(self):
+        with TemporaryDirectory() as d:
+            b = OutputBudget(self.send, maxsize = 10, tail_size = 4, spill_dir = d)
+            b.start("1")
+            self.assertTrue(b.allow(6))
+            self.assertFalse(b.allow(6))
+            b.write("stdout", "0123456789")
+            b.finish()
+            self.assertEqual(self.sent[0], ("stdout", "0123"))
+
+    def test_read_until_lines(self):
+        reads = iter(["a\r\nb", "\r\nc 0123456789abcdef:0", ":0:0.1;\x1b[?2004h"])
+        chunks = []
+        (i, m, rest, n) = read_until(reads.__next__,
+            [re.compile(r"0123456789abcdef:(\d+):([\d,]*):([\d.]+);"), re.compile("^PS2> ", re.MULTILINE)],
+            chunks.append, chunk_size = 64, window = 32, text = "x")
+        self.assertEqual((i, m.group(1), rest, n), (0, "0", "\x1b[?2004h", 3))
+        self.assertEqual(chunks, ["xa\r\n", "b\r\n", "c "])
+
+    def test_read_until_chunks_long_lines(self):
+        reads = iter(["x" * 10] * 100 + ["end;"])
+        chunks = []
+        (i, m, rest, n) = read_until(reads.__next__, [re.compile("xend;")], chunks.append,
+            chunk_size = 64, window = 8)
+        self.assertEqual("".join(chunks), "x" * 999)
+        self.assertLessEqual(max(map(len, chunks)), 64 + 10)
+        self.assertGreater(len(chunks), 10)
+
+    def test_read_until_progress_line_is_bounded(self):
+        (chunk_size, reads) = (1 << 16, 4000)
+        data = iter(["0%\r"] + ["x" * 4096] * reads + ["END;"])
+        sent = {"messages": 0, "characters": 0, "stream": 0}
+
+        def count(kind, text):
+            sent["messages"] += 1
+            sent["characters"] += len(text)
+            sent["stream"] += len(text) if kind == "stdout" else 0
+
+        p = ProgressCollapser(count, lambda display_id, text, update: count("display", text),
+            interval = 0, maxrows = 64)
+        tracemalloc.start()
+        try:
+            read_until(data.__next__, [re.compile("END;")], lambda text: p.write("stdout", text),
+                chunk_size = chunk_size, window = 8 << 10)
+            p.finish()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 32 * chunk_size)  # the input is 250 times chunk_size
+        self.assertLess(sent["characters"], 2 * reads * 4096)
+        self.assertLess(sent["messages"], 4 * reads * 4096 // chunk_size)
+        self.assertGreater(sent["stream"], reads * 4096 - 2 * chunk_size)
+
+
+if __name__ == '__main__':
+    main()
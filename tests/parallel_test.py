@@ -0,0 +1,63 @@
+import os
+import shutil
+from unittest import TestCase, main, skipUnless
+
+from zsh_jupyter_kernel.parallel import ParallelRun, parse_magic
+
+class parallel_test(TestCase):
+
+    def test_parse_magic(self):
+        self.assertIsNone(parse_magic("print 1"))
+        self.assertIsNone(parse_magic("%%parallelx\nprint 1"))
+        self.assertEqual(parse_magic("%%parallel\nprint 1\n\n# comment\nprint 2\n"), (None, ["print 1", "print 2"]))
+        self.assertEqual(parse_magic("%%parallel -j 4 gzip -k {}\na.txt\nb c.txt"),
+            (4, ["gzip -k a.txt", "gzip -k 'b c.txt'"]))
+        self.assertEqual(parse_magic("%%parallel -j2 ping -c 1\nlocalhost"), (2, ["ping -c 1 localhost"]))
+
+    def test_label(self):
+        run = ParallelRun(["true"], 1, ".", {}, "utf-8", "replace")
+        self.assertEqual(run._label(0, "stdout", "a\nb"), "[1] a\n[1] b")
+        self.assertEqual(run._label(0, "stdout", "c\n"), "c\n")
+        self.assertEqual(run._label(0, "stdout", "d\n\ne"), "[1] d\n[1] \n[1] e")
+        self.assertEqual(run._label(0, "stderr", "x\n"), "[1] x\n")
+
+    @skipUnless(shutil.which("zsh"), "needs zsh")
+    def test_order(self):
+        cmds = ["sleep 0.3; print one", "print two; exit 3", "print -u2 three"]
+        run = ParallelRun(cmds, 2, os.getcwd(), dict(os.environ), "utf-8", "replace")
+        output = []
+        self.assertTrue(run.run(lambda name, text: output.append((name, text))))
+        self.assertEqual(output, [("stdout", "[1] one\n"), ("stdout", "[2] two\n"), ("stderr", "[3] three\n")])
+        self.assertEqual([result["exit_status"] for result in run.results], [0, 3, 0])
+
+    @skipUnless(shutil.which("zsh"), "needs zsh")
+    def test_maxbuffer(self):
+        cmds = ["sleep 0.5; print first", "head -c 4000000 /dev/zero | tr '\\0' x"]
+        run = ParallelRun(cmds, 2, os.getcwd(), dict(os.environ), "utf-8", "replace",
+            read_size = 1 << 12, maxbuffer = 1 << 16)
+        held = []
+        size = 0
+        def emit(name, text):
+            nonlocal size
+            if text.startswith("[1]"):
+                held.append(sum(len(text) for (_, text) in run._buffers.get(1, [])))
+            else:
+                size += len(text)
+        self.assertTrue(run.run(emit))
+        self.assertLess(held[0], (1 << 16) + (1 << 12))
+        self.assertEqual(size, len("[2] ") + 4000000)
+
+    @skipUnless(shutil.which("zsh"), "needs zsh")
+    def test_deadline(self):
+        run = ParallelRun(["sleep 10"], 1, os.getcwd(), dict(os.environ), "utf-8", "replace")
+        self.assertFalse(run.run(lambda name, text: None, deadline = 0))
+        self.assertEqual(run.procs, {})
+
+    def test_missing_cwd(self):
+        run = ParallelRun(["true", "true"], 2, "/nonexistent/parallel_test", {}, "utf-8", "replace")
+        with self.assertRaises(OSError):
+            run.run(lambda name, text: None)
+        self.assertEqual(run.procs, {})
+
+if __name__ == '__main__':
+    main()
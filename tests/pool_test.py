@@ -0,0 +1,27 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.pool import sync_cmds, take_shell
+
+class pool_test(TestCase):
+
+    def test_sync_cmds(self):
+        cmds = sync_cmds("/tmp/a b",
+            env = {"PATH": "/bin", "LANG": "C", "JPY_SESSION_NAME": "x y.ipynb", "PWD": "/tmp"},
+            pool_env = {"PATH": "/bin", "LANG": "en_US.UTF-8", "SSH_TTY": "/dev/pts/1", "PWD": "/"},
+        )
+        self.assertEqual(cmds, [
+            "cd -q '/tmp/a b'",
+            "export JPY_SESSION_NAME='x y.ipynb'",
+            "export LANG=C",
+            "unset SSH_TTY",
+        ])
+
+    def test_pool_not_available(self):
+        with TemporaryDirectory() as d:
+            self.assertIsNone(take_shell(os.path.join(d, "pool.sock"), timeout = 0.1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import gzip
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.store import OutputStore
+
+class store_test(TestCase):
+
+    def test_entries(self):
+        with TemporaryDirectory() as d:
+            store = OutputStore(d, maxbytes = 1 << 20)
+            store.start(1)
+            store.write("hello, ")
+            store.write("world\n")
+            self.assertIsNone(store.read(1))  # not finished yet
+            store.start(2)  # finishes 1
+            store.write("two\n")
+            store.finish()
+            store.finish()
+            self.assertEqual(store.read(1), b"hello, world\n")
+            self.assertEqual(store.read(2), b"two\n")
+            self.assertIsNone(store.read(3))
+            self.assertEqual(list(Path(d).iterdir()), [])
+            path = store.spill(1)
+            self.assertEqual(gzip.decompress(path.read_bytes()), b"hello, world\n")
+            self.assertNotIn(1, store.memory)
+            self.assertEqual(store.read(1), b"hello, world\n")
+            self.assertIsNone(store.spill(3))
+
+    def test_budget(self):
+        with TemporaryDirectory() as d:
+            store = OutputStore(d, maxbytes = 64)
+            for n in range(1, 11):
+                store.start(n)
+                store.write(f"{n}\n" * 100)
+            store.finish()
+            self.assertLessEqual(store.nbytes, 64)
+            self.assertNotIn(1, store.memory)
+            self.assertIn(10, store.memory)
+            self.assertTrue(store.path(1).exists())
+            for n in range(1, 11):
+                self.assertEqual(store.read(n), f"{n}\n".encode() * 100)
+
+    def test_large_entry(self):
+        with TemporaryDirectory() as d:
+            store = OutputStore(d, maxbytes = 1 << 10)
+            text = "".join(f"{i}\n" for i in range(100000))
+            store.start(1)
+            for i in range(0, len(text), 4096):
+                store.write(text[i:i + 4096])
+            store.finish()
+            self.assertEqual(store.memory, {})
+            self.assertEqual(store.read(1), text.encode())
+            self.assertEqual([p.name for p in Path(d).iterdir()], ["1.gz"])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+from unittest import TestCase, main
+
+from zsh_jupyter_kernel.syntax import SyntaxChecker
+
+class syntax_test(TestCase):
+
+    def test_classify(self):
+        samples = [
+            ("echo 'it''s'", "", "complete"),
+            ("echo 'open", "check.zsh:3: unmatched '", "incomplete"),
+            ("1()", "check.zsh:3: parse error", "incomplete"),
+            ("if true; then", "check.zsh:3: parse error near `then'", "incomplete"),
+            ("echo $((2 + 2)", "check.zsh:3: parse error near `$((2 + 2)'", "incomplete"),
+            ("echo )", "check.zsh:3: parse error near `)'", "invalid"),
+            ("fi\necho 1", "check.zsh:3: parse error near `fi'", "invalid"),
+            ("for x in 1; do echo $x; done; done", "check.zsh:3: parse error near `done'", "invalid"),
+        ]
+        for code, errors, status in samples:
+            with self.subTest(code = code):
+                self.assertEqual(SyntaxChecker.classify(code, errors), status)
+
+    def test_indent(self):
+        self.assertEqual(SyntaxChecker.indent("for x in 1 2; do"), "    ")
+        self.assertEqual(SyntaxChecker.indent("if true; then\n    echo 1"), "    ")
+        self.assertEqual(SyntaxChecker.indent("f() {\n    if true; then\n"), "        ")
+
+
+if __name__ == '__main__':
+    main()
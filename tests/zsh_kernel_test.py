@@ -1,5 +1,7 @@
 import inspect
+import os
 import queue
+import time
 import unittest
 
 import jupyter_client
@@ -9,7 +11,8 @@ from . import msgspec_v5
 
 TIMEOUT = 1
 
-class zsh_kernel_tests(unittest.TestCase):
+class zsh_kernel_case(unittest.TestCase):
+    """Starts a kernel for the tests of a subclass and helps talking to it."""
     km: jupyter_client.KernelManager
     kc: jupyter_client.BlockingKernelClient
     
@@ -88,6 +91,8 @@ class zsh_kernel_tests(unittest.TestCase):
         reply = self.get_non_kernel_info_reply(timeout = timeout)
         msgspec_v5.validate_message(reply, "history_reply", msg_id)
         return reply
+
+class zsh_kernel_tests(zsh_kernel_case):
     
     def test_kernel_info(self):
         self.flush_channels()
@@ -121,6 +126,38 @@ class zsh_kernel_tests(unittest.TestCase):
         else:
             self.assertTrue(False, "expected one output message of type 'stream' and 'content.name'='stdout'")
     
+    def test_multiline_constructs(self):
+        self.flush_channels()
+        code = "\n".join([
+            "greet() {",
+            "    print hello, $1",
+            "}",
+            "for x in a b; do",
+            "    greet $x",
+            "done",
+            "cat <<EOF",
+            "heredoc line",
+            "EOF",
+            "print " + "x" * 8192,
+        ])
+        reply, output_msgs = self.execute(code = code)
+        self.assertEqual(reply["content"]["status"], "ok")
+        text = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertIn("hello, a", text)
+        self.assertIn("hello, b", text)
+        self.assertIn("heredoc line", text)
+        self.assertIn("x" * 8192, text)
+    
+    def test_exit_status(self):
+        self.flush_channels()
+        reply, output_msgs = self.execute(code = "print PEXPECT_PS1 '> '\ntrue | false | true; (exit 3)")
+        self.assertEqual(reply["content"]["status"], "ok")
+        self.assertEqual(reply["metadata"]["exit_status"], 3)
+        self.assertEqual(reply["metadata"]["pipestatus"], [3])
+        self.assertGreaterEqual(reply["metadata"]["elapsed"], 0)
+        reply, output_msgs = self.execute(code = "true | false | true")
+        self.assertEqual(reply["metadata"]["pipestatus"], [0, 1, 0])
+    
     def test_completion(self):
         samples = [
             {
@@ -148,13 +185,216 @@ class zsh_kernel_tests(unittest.TestCase):
         with self.subTest(status = "complete"):
             for sample in [
                 'print complete code sample; echo "100% guarantee"',
-                '123'
+                '123',
+                "echo 'single quotes'",
             ]:
                 self.check_is_complete(sample, "complete")
         with self.subTest(status = "incomplete"):
             for sample in [
                 "1()",
                 "echo $((2 + 2)",
-                # "something with open single quote '", # fixme: this fails. need to handle special chars
+                "something with open single quote '",
+                "for x in 1 2; do",
             ]:
                 self.check_is_complete(sample, "incomplete")
+        with self.subTest(status = "invalid"):
+            for sample in [
+                "echo )",
+                "fi",
+            ]:
+                self.check_is_complete(sample, "invalid")
+
+    def test_display(self):
+        self.flush_channels()
+        reply, output_msgs = self.execute(code = "\n".join([
+            "f=${TMPDIR:-/tmp}/zsh-jupyter-kernel-test.html",
+            "print '<b>bold</b>' > $f",
+            "print before; display $f; rm $f; print after",
+            "print '<svg/>' | display -t image/svg+xml",
+        ]))
+        self.assertEqual(reply["content"]["status"], "ok")
+        # stream output and display requests are read by different threads, so the order of output
+        # before a display is not checked. `display` returns once the file is read, so output after it follows it
+        streams = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertIn("before", streams)
+        types = [msg["msg_type"] for msg in output_msgs]
+        after = next(i for (i, msg) in enumerate(output_msgs)
+            if msg["msg_type"] == "stream" and "after" in msg["content"]["text"])
+        self.assertLess(types.index("display_data"), after)
+        displays = [msg["content"]["data"] for msg in output_msgs if msg["msg_type"] == "display_data"]
+        self.assertEqual(displays[0]["text/html"], "<b>bold</b>\n")
+        self.assertEqual(displays[1]["image/svg+xml"], "<svg/>\n")
+    
+    def test_history(self):
+        reply = self.get_history(["print history 1", "print history 2"],
+            hist_access_type = "tail", n = 2, output = False, raw = True)
+        self.assertEqual([x[2] for x in reply["content"]["history"]], ["print history 1", "print history 2"])
+        line = reply["content"]["history"][-1][1]
+        reply = self.get_history([], hist_access_type = "range", session = 0, start = line, stop = line + 1,
+            output = False, raw = True)
+        self.assertEqual([x[2] for x in reply["content"]["history"]], ["print history 2"])
+        reply = self.get_history([], hist_access_type = "search", pattern = "print hist*", n = 1, unique = True,
+            output = False, raw = True)
+        self.assertEqual([x[2] for x in reply["content"]["history"]], ["print history 2"])
+        reply, output_msgs = self.execute(code = "fc -ln -2")
+        text = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertIn("print history 2", text)
+        self.assertNotIn("__zsh_jupyter_kernel", text)
+    
+    def test_parallel(self):
+        self.flush_channels()
+        reply, output_msgs = self.execute(code = "\n".join([
+            "%%parallel -j 2 print -r --",
+            "slow $(sleep 0.5)",
+            "fast",
+        ]), timeout = 5)
+        self.assertEqual(reply["content"]["status"], "ok")
+        text = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertEqual(text, "[1] slow $(sleep 0.5)\n[2] fast\n")
+        reply, output_msgs = self.execute(code = "export PARALLEL_TEST=inherited; cd /")
+        reply, output_msgs = self.execute(code = "%%parallel\nprint $PARALLEL_TEST $PWD\nexit 3")
+        text = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertEqual(text, "[1] inherited /\n")
+        self.assertEqual(reply["metadata"]["exit_status"], 3)
+        self.assertEqual([x["exit_status"] for x in reply["metadata"]["parallel"]], [0, 3])
+        self.execute(code = "cd -")
+        self.execute(code = "d=$(mktemp -d); cd $d; rmdir $d")
+        reply, output_msgs = self.execute(code = "%%parallel\ntrue")
+        self.assertEqual(reply["content"]["ename"], "ParallelError")
+        self.execute(code = "cd -")
+    
+    def test_long_line(self):
+        self.flush_channels()
+        reply, output_msgs = self.execute(code = "head -c 1000000 /dev/zero | tr '\\0' x; print", timeout = 10)
+        self.assertEqual(reply["content"]["status"], "ok")
+        text = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertEqual(text.strip(), "x" * 1000000)
+        self.assertGreater(len([msg for msg in output_msgs if msg["msg_type"] == "stream"]), 1)
+    
+    def test_progress(self):
+        self.flush_channels()
+        reply, output_msgs = self.execute(code = "print start; for i in {1..100}; print -n \"\\r$i%\"; print")
+        self.assertEqual(reply["content"]["status"], "ok")
+        streams = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertIn("start", streams)
+        self.assertNotIn("50%", streams)
+        displays = [msg for msg in output_msgs if msg["msg_type"] in ("display_data", "update_display_data")]
+        self.assertEqual(displays[0]["msg_type"], "display_data")
+        self.assertEqual(displays[-1]["content"]["data"]["text/plain"].strip(), "100%")
+        self.assertLess(len(displays), 20)
+    
+    def test_parallel_long_cell(self):
+        self.flush_channels()
+        self.execute(code = "export PARALLEL_EMPTY= PARALLEL_AFTER=after")
+        # longer than the input limit of the terminal
+        lines = [f"print -r -- $PARALLEL_AFTER {i} {'x' * 40}" for i in range(100)]
+        reply, output_msgs = self.execute(code = "%%parallel -j 4\n" + "\n".join(lines), timeout = 20)
+        self.assertEqual(reply["content"]["status"], "ok")
+        text = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertIn("[100] after 99 ", text)
+    
+    def test_out(self):
+        self.flush_channels()
+        reply, output_msgs = self.execute(code = "print stored output")
+        n = reply["content"]["execution_count"]
+        reply, output_msgs = self.execute(code = f"out {n} | tr a-z A-Z; gzip -dc $(out -p {n}); out 0")
+        self.assertEqual(reply["content"]["status"], "ok")
+        streams = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertIn("STORED OUTPUT", streams)
+        self.assertIn("stored output", streams)
+        self.assertIn("no stored output of cell 0", streams)
+    
+    def test_metrics(self):
+        self.flush_channels()
+        self.execute(code = "true")
+        msg = self.kc.session.msg("metrics_request", {})
+        self.kc.control_channel.send(msg)
+        reply = self.run_sync(self.kc.control_channel.get_msg)(timeout = TIMEOUT)
+        self.assertEqual(reply["header"]["msg_type"], "metrics_reply")
+        self.assertEqual(reply["parent_header"]["msg_id"], msg["header"]["msg_id"])
+        self.assertGreaterEqual(reply["content"]["histograms"]["execute"]["count"], 1)
+        self.assertGreaterEqual(reply["content"]["counters"]["expect_iterations"], 1)
+
+class zsh_kernel_pipes_tests(zsh_kernel_tests):
+    """Reruns the tests with stdout and stderr of cells redirected to pipes."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.km, cls.kc = jupyter_client.manager.start_new_kernel(kernel_name = "zsh",
+            env = {**os.environ, "ZSH_JUPYTER_KERNEL_STREAMS": "pipes"})
+    
+    def test_hello_world_stderr(self):
+        self.flush_channels()
+        reply, output_msgs = self.execute(code = ">&2 print 'hello, world'; print 'hello, stdout'")
+        self.assertEqual(reply["content"]["status"], "ok")
+        streams = {msg["content"]["name"]: msg["content"]["text"]
+            for msg in output_msgs if msg["msg_type"] == "stream"}
+        self.assertIn("hello, world", streams["stderr"])
+        self.assertIn("hello, stdout", streams["stdout"])
+    
+    def test_bulk_output(self):
+        self.flush_channels()
+        reply, output_msgs = self.execute(code = "seq 1000000", timeout = 10)
+        self.assertEqual(reply["content"]["status"], "ok")
+        text = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertTrue(text.endswith("999999\n1000000\n"))
+        self.assertLess(len(output_msgs), 200)
+
+class zsh_kernel_limits_tests(zsh_kernel_tests):
+    """Reruns the tests with a deadline for cells."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.km, cls.kc = jupyter_client.manager.start_new_kernel(kernel_name = "zsh",
+            env = {**os.environ, "ZSH_JUPYTER_KERNEL_CELL_TIMEOUT": "2"})
+    
+    def test_cell_timeout(self):
+        self.flush_channels()
+        reply, output_msgs = self.execute(code = "print started; sleep 60", timeout = 10)
+        self.assertEqual(reply["content"]["status"], "error")
+        self.assertEqual(reply["content"]["ename"], "CellTimeoutError")
+        reply, output_msgs = self.execute(code = "print still here")
+        self.assertEqual(reply["content"]["status"], "ok")
+    
+    def test_interrupt_escalation(self):
+        self.flush_channels()
+        # ignores SIGINT and SIGTERM, so only SIGKILL ends it
+        reply, output_msgs = self.execute(code = "zsh -fc 'trap \"\" INT TERM; sleep 60'", timeout = 15)
+        self.assertEqual(reply["content"]["ename"], "CellTimeoutError")
+        reply, output_msgs = self.execute(code = "print still here")
+        self.assertEqual(reply["content"]["status"], "ok")
+    
+    def test_interrupt_during_escalation(self):
+        self.flush_channels()
+        self.kc.execute(code = "zsh -fc 'trap \"\" INT TERM; sleep 60'")
+        time.sleep(0.5)
+        self.km.interrupt_kernel()
+        time.sleep(0.2)
+        self.km.interrupt_kernel()  # while the kernel waits for the shell after SIGINT
+        reply = self.get_non_kernel_info_reply(timeout = 15)
+        self.assertEqual(reply["content"]["status"], "error")
+        self.flush_channels()
+        reply, output_msgs = self.execute(code = "print still here", timeout = 15)
+        self.assertEqual(reply["content"]["status"], "ok")
+        text = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertIn("still here", text)
+
+class zsh_kernel_line_mode_tests(zsh_kernel_case):
+    """Tests of the mode sending cells line by line to the shell."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.km, cls.kc = jupyter_client.manager.start_new_kernel(kernel_name = "zsh",
+            env = {**os.environ, "ZSH_JUPYTER_KERNEL_EXECUTION_MODE": "line"})
+    
+    def test_long_cell(self):
+        self.flush_channels()
+        # longer than the input limit of the terminal, which the lines are not
+        code = "\n".join(f"print line {i}" for i in range(1000))
+        reply, output_msgs = self.execute(code = code, timeout = 20)
+        self.assertEqual(reply["content"]["status"], "ok")
+        text = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertIn("line 999", text)
+        reply, output_msgs = self.execute(code = "fc -ln -2")
+        text = "".join(msg["content"]["text"] for msg in output_msgs if msg["msg_type"] == "stream")
+        self.assertIn("print line 999", text)
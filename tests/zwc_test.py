@@ -0,0 +1,34 @@
+import shutil
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main, skipUnless
+
+from zsh_jupyter_kernel.zwc import compile_scripts
+
+class zwc_test(TestCase):
+
+    @skipUnless(shutil.which("zsh"), "needs zsh")
+    def test_compile(self):
+        with TemporaryDirectory() as d:
+            src = Path(d, "src")
+            src.mkdir()
+            src.joinpath("a.zsh").write_text("print a\n")
+            cache = Path(d, "cache")
+            target = compile_scripts(src, cache)
+            self.assertEqual(target.parent, cache)
+            self.assertEqual(sorted(p.name for p in target.iterdir()), ["a.zsh", "a.zsh.zwc"])
+            self.assertEqual(compile_scripts(src, cache), target)
+            src.joinpath("a.zsh").write_text("print b\n")
+            self.assertNotEqual(compile_scripts(src, cache), target)
+
+    def test_fallback(self):
+        with TemporaryDirectory() as d:
+            src = Path(d, "src")
+            src.mkdir()
+            src.joinpath("a.zsh").write_text("print a\n")
+            cache = Path(d, "cache")
+            cache.write_text("not a directory")
+            self.assertEqual(compile_scripts(src, cache), src)
+
+if __name__ == '__main__':
+    main()
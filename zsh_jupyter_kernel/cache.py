@@ -0,0 +1,70 @@
+__all__ = ['LRUCache']
+
+import time
+from collections import OrderedDict as odict
+from typing import Any, Callable, Hashable, Optional
+
+class LRUCache:
+    """
+    Mapping which evicts least recently used entries once it holds more than
+    `maxsize` entries or, when `sizeof` is given, more than `maxbytes` in total.
+    Entries older than `ttl` seconds are treated as missing.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None,
+            maxbytes: Optional[int] = None, sizeof: Callable[[Any], int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._entries: odict = odict()  # key -> (value, created, size)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: Hashable, default = None):
+        try:
+            value, created, _ = self._entries[key]
+        except KeyError:
+            return default
+        if self.ttl is not None and time.monotonic() - created > self.ttl:
+            self.pop(key)
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value):
+        self.pop(key)
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            return  # would evict everything else and still not fit
+        self._entries[key] = (value, time.monotonic(), size)
+        self.nbytes += size
+        while len(self._entries) > self.maxsize or \
+                (self.maxbytes is not None and self.nbytes > self.maxbytes):
+            self._evict(next(iter(self._entries)))
+
+    def pop(self, key: Hashable, default = None):
+        if key not in self._entries:
+            return default
+        value, _, size = self._entries.pop(key)
+        self.nbytes -= size
+        return value
+
+    def evict_if(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Evicts all entries whose key matches `predicate`. Returns their number."""
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            self._evict(key)
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def _evict(self, key: Hashable):
+        self.pop(key)
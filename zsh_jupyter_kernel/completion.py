@@ -0,0 +1,61 @@
+__all__ = ['CompletionWorker', 'ShellState']
+
+from typing import NamedTuple
+
+from .worker import Worker
+
+class ShellState(NamedTuple):
+    """
+    The parts of the kernel shell state completions depend on.
+    `hash_generation` changes when commands are hashed by hand or added to or removed from a PATH directory.
+    Unknown fields are empty and are ignored by the worker.
+    """
+    cwd: str = ""
+    path: str = ""
+    fpath: str = ""
+    hash_generation: str = ""
+
+    # a single command printing the marker and the fields separated by null bytes.
+    # the hash generation is the number of hashed commands and the modification times of the PATH directories
+    marker = "\0shell-state\0"
+    query = (
+        r'''() { local d m g=${#commands}; zmodload -F zsh/stat b:zstat 2>/dev/null; '''
+        r'''for d in $path; zstat -A m +mtime -- $d 2>/dev/null && g+=:$m; '''
+        r'''print -rn -- $'\0'shell-state$'\0'"$PWD"$'\0'"$PATH"$'\0'"$FPATH"$'\0'"$g"; }'''
+    )
+
+    @classmethod
+    def parse(cls, output: str) -> tuple[str, 'ShellState']:
+        """
+        Returns the output of the shell before the last marker, like notifications of background jobs
+        which ended since the last request, and the state after it.
+        """
+        (before, _, fields) = output.rpartition(cls.marker)
+        return (before, cls(*fields.split("\0")[:4]))
+
+class CompletionWorker(Worker):
+    """
+    Long-lived completion process (see `complete.zsh`).
+    The completion system is initialized once when the worker starts;
+    afterwards every request costs only the completion functions themselves.
+    """
+
+    def complete(self, state: ShellState, context: str) -> list[tuple[str, str]]:
+        """
+        Returns `(match, description)` pairs for the last line of `context`
+        completed in a shell synced to `state`.
+        """
+        payload = "\0".join([*state, self.line(context)]).encode()
+        reply = self.request(payload)
+        if not reply:
+            return []
+        return [
+            (match, description)
+            for match, _, description in
+            (line.partition(" -- ") for line in reply.decode(errors = "replace").splitlines())
+        ]
+
+    @staticmethod
+    def line(context: str) -> str:
+        """The part of `context` which is actually sent for completion."""
+        return context.rsplit("\n", 1)[-1].replace("\t", " ")
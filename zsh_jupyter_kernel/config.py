@@ -21,11 +21,36 @@ if logging_enabled:
     logging_file_path = logging_dir_path / "kernel.log"
     config["logging_file_path"] = str(logging_file_path)
     config["logging_formatter"] = "%(asctime)s | %(name)-10s | %(levelname)-6s | %(message)s"
+# log files are rotated when they reach max_bytes
+config["logging_max_bytes"] = int(os.environ.get("ZSH_JUPYTER_KERNEL_LOGGING_MAX_BYTES", str(16 << 20)))
+config["logging_backup_count"] = 3
+# share of records logged per category as `category=rate,...`, e.g. `output=0.01` logs every 100th output record
+config["logging_sampling"] = {
+    category: float(rate)
+    for (category, _, rate) in (
+        x.partition("=") for x in os.environ.get("ZSH_JUPYTER_KERNEL_LOGGING_SAMPLING", "").split(",") if x
+    )
+}
+
+# persistent caches. created on first use
+cache_dir_path = Path(os.environ.get("ZSH_JUPYTER_KERNEL_CACHE_PATH",
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "zsh-jupyter-kernel"))
+config["cache_dir_path"] = str(cache_dir_path)
+# persistent data like the history of all kernels
+data_dir_path = Path(os.environ.get("ZSH_JUPYTER_KERNEL_DATA_PATH",
+    Path(os.environ.get("XDG_DATA_HOME", Path.home() / ".local" / "share")) / "zsh-jupyter-kernel"))
+config["data_dir_path"] = str(data_dir_path)
 
 config["pexpect"] = {
     "encoding": "utf-8",
     "codec_errors": "replace",  # [codecs]
     "timeout": None,  # [pexpect-spawn-timeout]
+    # characters read from the terminal at once. pexpect reads 2000 by default
+    "maxread": 1 << 16,  # [pexpect-spawn-maxread]
+    # characters at the end of the output searched for the sentinel and prompts after each read.
+    # pexpect searches all output since the last match by default, which is quadratic in the length of a line.
+    # it must be longer than a sentinel, which is followed only by the empty prompt
+    "searchwindowsize": 8 << 10,  # [pexpect-spawn-searchwindowsize]
     "logging_file_path": str(logging_dir_path / "pexpect.log"),
 }
 
@@ -39,14 +64,131 @@ config["zsh"] = {
         "preexec() {}",
         # [zsh-functions]
     ],
+    "init_script": str(path.with_name("init.zsh")),
+    "helpers_script": str(path.with_name("helpers.zsh")),  # defines the `display` and `out` helpers
+    # scripts of the kernel are run from zcompiled copies in this directory. None to run them as they are
+    "zwc_dir_path": str(cache_dir_path / "zwc")
+        if os.environ.get("ZSH_JUPYTER_KERNEL_ZCOMPILE", "1") == "1" else None,
     "config_cmds": [
         "unset zle_bracketed_paste",  # [zsh-bracketed-paste]
         "zle_highlight=(none)",  # https://linux.die.net/man/1/zshzle
     ],
+    "pool": {
+        # unix socket of a `python -m zsh_jupyter_kernel.pool` server which hands out initialized shells.
+        # None to always spawn a new shell
+        "socket_path": os.environ.get("ZSH_JUPYTER_KERNEL_POOL_SOCKET") or None,
+        "timeout": 1,  # seconds to wait for a shell before spawning one
+    },
 }
 
 config["kernel"] = {
-    "code_completion": {"cmd": str(path.with_name("capture.zsh")) + " {}"},
+    "execution": {
+        # "cell" sources each cell as a whole from a file, so multiline constructs and long lines just work.
+        # "line" sends the cell line by line to the shell as if typed
+        "mode": os.environ.get("ZSH_JUPYTER_KERNEL_EXECUTION_MODE", "cell"),
+        # reply with an error when the last command of a cell exits with a non-zero status
+        "fail_on_error": os.environ.get("ZSH_JUPYTER_KERNEL_FAIL_ON_ERROR", "0") == "1",
+        # "pty" writes all output to the terminal of the shell like an interactive session does.
+        # "pipes" redirects stdout and stderr of cells to kernel-owned pipes, which separates them
+        # and is much faster for bulk output. programs which need a terminal can write to /dev/tty
+        "streams": os.environ.get("ZSH_JUPYTER_KERNEL_STREAMS", "pty"),
+        "pipe_read_size": 1 << 16,  # bytes
+    },
+    "limits": {
+        # seconds a cell may run before it is interrupted. 0 for no limit
+        "cell_timeout": float(os.environ.get("ZSH_JUPYTER_KERNEL_CELL_TIMEOUT", "0")),
+        # signals sent to the foreground process group of an interrupted cell, each followed by
+        # the seconds to wait for the prompt. the shell is restarted when it does not come back
+        "interrupt_schedule": [("SIGINT", 2), ("SIGTERM", 3), ("SIGKILL", 2)],
+        # options of `ulimit` for the shell and so all processes of cells, e.g. "-v 4000000 -n 1024"
+        "ulimit": os.environ.get("ZSH_JUPYTER_KERNEL_ULIMIT", ""),
+        # a cgroup v2 directory delegated to the user. the shell is moved into a child cgroup of it
+        # with the limits below written to its `cpu.max` and `memory.max`, e.g. "200000 100000" for 2 CPUs and "4G"
+        "cgroup_path": os.environ.get("ZSH_JUPYTER_KERNEL_CGROUP_PATH") or None,
+        "cpu_max": os.environ.get("ZSH_JUPYTER_KERNEL_CPU_MAX", ""),
+        "memory_max": os.environ.get("ZSH_JUPYTER_KERNEL_MEMORY_MAX", ""),
+    },
+    "parallel": {
+        # zsh processes running the lines of a `%%parallel` cell at once, unless given with `-j`
+        "jobs": int(os.environ.get("ZSH_JUPYTER_KERNEL_PARALLEL_JOBS", "0")) or os.cpu_count() or 1,
+        # characters of each output stream of a line held while the lines before it run.
+        # past it the line blocks on writing its output until it is the first unfinished one
+        "maxbuffer": 1 << 20,
+    },
+    "output": {
+        # stream output is sent in batches of up to flush_size characters
+        # or after flush_interval seconds, whichever comes first
+        "flush_size": 64 << 10,
+        "flush_interval": 0.05,  # seconds
+        # characters of a line read from the terminal after which it is sent in chunks instead of as a whole.
+        # longer than the searchwindowsize of pexpect
+        "chunk_size": 64 << 10,
+        # characters of output of a cell which are sent to the frontend. the rest is written to a spill file
+        # of which only the last tail_size characters are sent. 0 for no limit
+        "cell_limit": int(os.environ.get("ZSH_JUPYTER_KERNEL_OUTPUT_LIMIT", str(1 << 20))),
+        "tail_size": 16 << 10,
+        "spill_dir_path": str(cache_dir_path / "spill"),
+        "spill_ttl": 7 * 24 * 60 * 60,  # seconds
+        # output redrawn with carriage returns or cursor movements, like progress bars, is shown
+        # in a display updated every interval seconds instead of being sent with every redraw
+        "progress": {
+            "enabled": os.environ.get("ZSH_JUPYTER_KERNEL_COLLAPSE_PROGRESS", "1") == "1",
+            "interval": 0.2,  # seconds
+            "maxrows": 64,  # rows of a display after which output is sent as stream again
+            # columns and characters of a display after which output of the cell is sent as stream
+            "maxcols": 4096,
+            "maxsize": 64 << 10,
+        },
+    },
+    "display": {
+        "maxsize": 64 << 20,  # bytes of a file to display
+        "cache_maxbytes": 64 << 20,  # of encoded files kept to be displayed again
+    },
+    "outputs": {
+        # stream output of cells is kept for the `out` helper
+        "store": os.environ.get("ZSH_JUPYTER_KERNEL_STORE_OUTPUTS", "1") == "1",
+        "maxbytes": 32 << 20,  # of compressed outputs in memory. older ones are moved to files in the run dir
+        "reply_timeout": 5,  # seconds to wait for a helper to read the reply to its request
+    },
+    "history": {
+        # executed cells of all kernels for `history_request`s
+        "enabled": os.environ.get("ZSH_JUPYTER_KERNEL_HISTORY", "1") == "1",
+        "file_path": str(data_dir_path / "history.sqlite"),
+        "timeout": 5,  # seconds to wait for the database when other kernels are writing
+    },
+    "code_completion": {
+        "capture_script": str(path.with_name("capture.zsh")),  # used when the worker is disabled
+        "cmd": """zsh -c '. "$0" "$@"' {script} {context}""",  # sourced, so its .zwc is used
+        "worker": os.environ.get("ZSH_JUPYTER_KERNEL_COMPLETION_WORKER", "1") == "1",
+        "worker_script": str(path.with_name("complete.zsh")),
+        "worker_start_timeout": 30,  # seconds. includes compinit
+        "worker_timeout": 5,  # seconds per request
+        "cache": {
+            "enabled": os.environ.get("ZSH_JUPYTER_KERNEL_COMPLETION_CACHE", "1") == "1",
+            "maxsize": 256,  # entries
+            "ttl": 300,  # seconds
+        },
+    },
+    "inspection": {
+        "cmd": "man --pager ul {}",
+        "width": int(os.environ.get("ZSH_JUPYTER_KERNEL_INSPECTION_WIDTH", "80")),  # columns
+        "timeout": 30,  # seconds
+        "maxbytes": 8 << 20,  # compressed pages kept in memory
+        "disk_dir_path": str(cache_dir_path / "man")
+            if os.environ.get("ZSH_JUPYTER_KERNEL_INSPECTION_DISK_CACHE", "1") == "1" else None,
+        "disk_ttl": 7 * 24 * 60 * 60,  # seconds
+    },
+    "metrics": {
+        # directory read by the textfile collector of the Prometheus node exporter. None to not write metrics there.
+        # metrics can always be requested with a `metrics_request` message
+        "textfile_dir_path": os.environ.get("ZSH_JUPYTER_KERNEL_METRICS_TEXTFILE_PATH") or None,
+        "textfile_interval": 15,  # seconds
+    },
+    "syntax_check": {
+        "script": str(path.with_name("check.zsh")),
+        "start_timeout": 5,  # seconds
+        "timeout": 1,  # seconds per request
+    },
     "info": {
         "protocol_version": "5.3",
         "implementation": "ZshKernel",
@@ -0,0 +1,57 @@
+__all__ = ['DisplayFiles']
+
+import base64
+import json
+import mimetypes
+import mmap
+import os
+
+from .cache import LRUCache
+
+class DisplayFiles:
+    """
+    Turns files requested by the `display` helper of `helpers.zsh` into `display_data` bundles.
+    Files are mapped into memory and encoded once. Bundles of unchanged files are kept
+    within `cache_maxbytes`, so showing the same file again costs nothing.
+    """
+
+    text_types = {"application/json", "application/javascript", "image/svg+xml"}
+
+    def __init__(self, maxsize: int, cache_maxbytes: int):
+        self.maxsize = maxsize
+        self.cache = LRUCache(maxsize = 1 << 10, maxbytes = cache_maxbytes,
+            sizeof = lambda bundle: sum(map(len, bundle.values())))
+
+    def bundle(self, path: str, mime: str = "", cache: bool = True) -> dict:
+        """
+        The data of a `display_data` message for the file at `path`.
+        Raises OSError when it cannot be read and ValueError when it is too large or not valid.
+        """
+        st = os.stat(path)
+        if st.st_size > self.maxsize:
+            raise ValueError(f"{path} is larger than {self.maxsize} bytes")
+        mime = mime or mimetypes.guess_type(path)[0] or "text/plain"
+        key = (path, mime, st.st_mtime_ns, st.st_size)
+        bundle = self.cache.get(key)
+        if bundle is not None:
+            return bundle
+        with open(path, "rb") as f:
+            if st.st_size == 0:
+                payload = self._encode(b"", mime)
+            else:
+                with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+                    payload = self._encode(m, mime)
+        bundle = {mime: payload}
+        if mime != "text/plain":
+            bundle["text/plain"] = f"<{mime} {os.path.basename(path)}>"  # for frontends without rich output
+        if cache:
+            self.cache.put(key, bundle)
+        return bundle
+
+    @classmethod
+    def _encode(cls, data, mime: str):
+        if mime.endswith("json"):
+            return json.loads(bytes(data))
+        if mime.startswith("text/") or mime in cls.text_types or mime.endswith("+xml"):
+            return str(data[:], "utf-8", "replace")
+        return base64.b64encode(data).decode("ascii")
@@ -0,0 +1,158 @@
+__all__ = ['History']
+
+import queue
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+_schema = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session INTEGER PRIMARY KEY AUTOINCREMENT,
+    start REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    session INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (session, line)
+);
+"""
+# trigram index of the sources for searches. needs sqlite 3.34
+_fts_schema = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    source, content = 'history', content_rowid = 'rowid', tokenize = 'trigram'
+);
+CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts (rowid, source) VALUES (new.rowid, new.source);
+END;
+"""
+_glob_special = re.compile(r"\*|\?|\[[^]]*\]?")
+
+class History:
+    """
+    Executed cells of all kernels of the user in an SQLite database, for `history_request`s.
+    Each kernel is a session and its cells are lines numbered by execution count.
+    Cells are written by a background thread, so executing never waits for the disk.
+    Tail and range lookups use the primary key and searches a trigram index of the sources,
+    so they stay fast with hundreds of thousands of entries.
+    Reads and `close` may come from any thread, e.g. shutdown from the control thread.
+    """
+
+    def __init__(self, path: str, timeout: float = 5, log = None):
+        self.path = Path(path)
+        self.timeout = timeout
+        self.log = log
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+        self.db = self._connect(check_same_thread = False)
+        self._lock = threading.Lock()  # of `db`
+        with self.db:
+            self.db.executescript(_schema)
+            try:
+                self.db.executescript(_fts_schema)
+                self.fts = True
+            except sqlite3.OperationalError:  # no fts5 or trigram tokenizer
+                self.fts = False
+            self.session = self.db.execute("INSERT INTO sessions (start) VALUES (?)", (time.time(),)).lastrowid
+        self._cells: queue.Queue = queue.Queue()  # (line, source) or None to stop
+        self._writer = threading.Thread(target = self._write, name = "history-writer", daemon = True)
+        self._writer.start()
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout = self.timeout, check_same_thread = check_same_thread)
+        db.execute("PRAGMA journal_mode = WAL")  # kernels read while others write
+        db.execute("PRAGMA synchronous = NORMAL")
+        return db
+
+    def add(self, line: int, source: str):
+        self._cells.put((line, source))
+
+    def close(self):
+        """Writes the cells still queued."""
+        self._cells.put(None)
+        self._writer.join(self.timeout)
+        with self._lock:
+            self.db.close()
+
+    def _write(self):
+        db = self._connect()
+        while True:
+            cells = [self._cells.get()]
+            while True:  # cells queued meanwhile are written in the same transaction
+                try:
+                    cells.append(self._cells.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in cells
+            try:
+                with db:
+                    db.executemany("INSERT OR IGNORE INTO history (session, line, source) VALUES (?, ?, ?)",
+                        [(self.session, line, source) for (line, source) in filter(None, cells)])
+            except sqlite3.Error as e:
+                if self.log:
+                    self.log.warning("could not write history: %r", e)
+            for _ in cells:
+                self._cells.task_done()
+            if stop:
+                db.close()
+                return
+
+    def tail(self, n: int, unique: bool = False) -> list[tuple[int, int, str]]:
+        """The last `n` cells of all sessions, oldest first."""
+        return self._query("", (), n, unique)
+
+    def search(self, pattern: str, n: Optional[int] = None, unique: bool = False) -> list[tuple[int, int, str]]:
+        """The last `n` cells matching the glob `pattern`, oldest first."""
+        if not pattern:
+            return self.tail(n or -1, unique)
+        match = self._fts_query(pattern)
+        if match:
+            # the index yields matches newest first, so the first `n` end the query
+            return self._query("JOIN history_fts ON history_fts.rowid = history.rowid"
+                " WHERE history_fts MATCH ? AND history.source GLOB ?", (match, pattern), n, unique,
+                order = "history_fts.rowid")
+        return self._query("WHERE history.source GLOB ?", (pattern,), n, unique)
+
+    def range(self, session: int, start: int, stop: Optional[int]) -> list[tuple[int, int, str]]:
+        """
+        Lines from `start` to before `stop` of a session.
+        A session of 0 or less is relative to the current one, as in IPython.
+        """
+        if session <= 0:
+            session += self.session
+        self._cells.join()
+        with self._lock:
+            return self.db.execute(
+                "SELECT session, line, source FROM history WHERE session = ? AND line >= ? AND line < ? ORDER BY line",
+                (session, start, stop if stop is not None else 1 << 62)).fetchall()
+
+    def _query(self, where: str, params: tuple, n: Optional[int], unique: bool,
+            order: str = "history.rowid") -> list[tuple[int, int, str]]:
+        self._cells.join()
+        with self._lock:
+            cursor = self.db.execute(
+                "SELECT history.session, history.line, history.source"
+                f" FROM history {where} ORDER BY {order} DESC LIMIT ?",
+                (*params, -1 if unique or n is None else n))
+            if unique:  # newest first, so the scan ends with the n-th distinct source
+                (rows, seen) = ([], set())
+                for row in cursor:
+                    if row[2] not in seen:
+                        seen.add(row[2])
+                        rows.append(row)
+                        if len(rows) == n:
+                            break
+                cursor.close()
+            else:
+                rows = cursor.fetchall()
+        rows.reverse()
+        return rows
+
+    def _fts_query(self, pattern: str) -> str:
+        """Trigram query for the literal parts of `pattern` or empty if they are too short to be indexed."""
+        if not self.fts:
+            return ""
+        parts = [part for part in _glob_special.split(pattern) if len(part) >= 3]
+        return " AND ".join('"' + part.replace('"', '""') + '"' for part in parts)
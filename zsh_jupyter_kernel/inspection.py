@@ -0,0 +1,101 @@
+__all__ = ['ManPages']
+
+import hashlib
+import os
+import time
+import zlib
+from pathlib import Path
+from typing import Optional
+
+import pexpect
+
+from .cache import LRUCache
+
+class ManPages:
+    """
+    Renders man pages for `do_inspect`.
+    Rendered pages are kept zlib-compressed in memory within `maxbytes` and,
+    when `disk_dir` is given, in files which survive kernel restarts.
+    Pages are keyed on the word, `$MANPATH` and the terminal width.
+    """
+
+    def __init__(self, cmd: str, width: int, maxbytes: int, disk_dir: Optional[str] = None,
+            disk_ttl: float = None, timeout: float = None, log = None):
+        self.cmd = cmd
+        self.width = width
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_ttl = disk_ttl
+        self.timeout = timeout
+        self.log = log
+        self.memory = LRUCache(maxsize = 1 << 16, maxbytes = maxbytes, sizeof = len)
+
+    def render(self, word: str) -> Optional[str]:
+        """Returns the rendered page or None if there is none."""
+        key = (word, os.environ.get("MANPATH", ""), self.width)
+        page = self.memory.get(key)
+        if page is None:
+            page = self._load(key)
+            if page is None:
+                page = self._render(word)
+                if page:
+                    self._store(key, page)
+            self.memory.put(key, page)
+        elif self.log:
+            self.log.debug("man page cache hit: %s", word)
+        return zlib.decompress(page).decode(errors = "replace") if page else None
+
+    def prune(self):
+        """Removes pages on disk older than `disk_ttl`, which would never be read again."""
+        if self.disk_dir is None or self.disk_ttl is None:
+            return
+        try:
+            for path in self.disk_dir.iterdir():
+                try:
+                    if time.time() - path.stat().st_mtime > self.disk_ttl:
+                        path.unlink()
+                except OSError:
+                    pass  # e.g. removed by another kernel meanwhile
+        except OSError:
+            pass
+
+    def _render(self, word: str) -> bytes:
+        """Compressed page or empty bytes when man fails."""
+        (output, exitstatus) = pexpect.run(
+            self.cmd.format(word),
+            withexitstatus = True,
+            timeout = self.timeout,
+            dimensions = (24, self.width),
+        )
+        if exitstatus != 0:
+            return b""
+        return zlib.compress(output)
+
+    def _path(self, key: tuple) -> Optional[Path]:
+        if self.disk_dir is None:
+            return None
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return self.disk_dir / f"{digest}.z"
+
+    def _load(self, key: tuple) -> Optional[bytes]:
+        path = self._path(key)
+        if path is None:
+            return None
+        try:
+            if self.disk_ttl is not None and time.time() - path.stat().st_mtime > self.disk_ttl:
+                return None  # the man page itself may have been updated since
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    def _store(self, key: tuple, page: bytes):
+        path = self._path(key)
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents = True, exist_ok = True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_bytes(page)
+            os.replace(tmp, path)  # concurrent kernels never see a partial page
+        except OSError as e:
+            if self.log:
+                self.log.debug("could not store man page %s: %r", path, e)
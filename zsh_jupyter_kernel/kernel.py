@@ -1,16 +1,49 @@
+import errno
 import json
 import logging
 import logging.handlers
 import os
+import queue
 import re
+import secrets
+import shlex
+import shutil
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
 from collections import OrderedDict as odict
-from typing import IO
+from pathlib import Path
+from typing import Optional
 
 import pexpect
 from ipykernel.kernelbase import Kernel
 
+from .cache import LRUCache
+from .completion import CompletionWorker, ShellState
 from .config import config
-from .fun import find_word_at_pos
+from .display import DisplayFiles
+from .history import History
+from .inspection import ManPages
+from .lexer import TokenIndex, unquote
+from .log import LogWriter, start_logging
+from .metrics import Metrics, timed
+from .output import OutputBudget, OutputCoalescer, PipeReader, ProgressCollapser, read_until
+from .parallel import ParallelRun, parse_magic
+from .pool import PooledShell, sync_cmds, take_shell
+from .store import OutputStore
+from .syntax import SyntaxChecker
+from .zwc import compiled
+
+class ExitStatusError(Exception):
+    """A cell finished with a non-zero exit status."""
+
+class CellTimeoutError(Exception):
+    """A cell ran longer than allowed and was interrupted."""
+
+class ParallelError(Exception):
+    """The commands of a `%%parallel` cell could not be started."""
 
 class ZshKernel(Kernel):
     implementation = config["kernel"]["info"]["implementation"]
@@ -20,33 +53,89 @@ class ZshKernel(Kernel):
     
     protocol_version = config["kernel"]["info"]["protocol_version"]
     
-    p: pexpect.spawn  # [spawn]
+    # metrics_request is answered on the control channel too, so metrics can be read during long executions
+    msg_types = [*Kernel.msg_types, "metrics_request"]
+    control_msg_types = [*Kernel.control_msg_types, "metrics_request"]
+    
+    p: pexpect.spawn | PooledShell  # [spawn]
+    pool_env: dict = None  # environment of the shell pool when the shell was taken from it
     
     ps = odict([
-        ("PS1", "PEXPECT_PS1 > "),
+        ("PS1", ""),  # the end of a command is marked by the sentinel printed by init.zsh instead
         ("PS2", "PEXPECT_PS2 + "),
         ("PS3", "PEXPECT_PS3 : "),
     ])
     ps_re = odict([
-        ("PS1", "^PEXPECT_PS1 > "),
-        ("PS2", r"^PEXPECT_PS2 \+ "),
-        ("PS3", "^PEXPECT_PS3 : "),
+        ("PS2", re.compile(r"^PEXPECT_PS2 \+ ", re.MULTILINE)),
+        ("PS3", re.compile("^PEXPECT_PS3 : ", re.MULTILINE)),
     ])
     
-    pexpect_logfile: IO = None
+    sentinel_re: re.Pattern = None  # matches `<nonce>:<status>:<pipestatus>:<elapsed>;` of the current request
+    last_status: dict = None  # of the last command of the current cell
+    zsh_starting: bool = False  # until the prompt after the initialization was read
+    
+    pexpect_logfile: LogWriter = None
     
     log_enabled: bool
+    log_listener: logging.handlers.QueueListener = None  # writes the records queued by all threads
+    
+    completer: CompletionWorker = None
+    completion_cache: LRUCache = None
+    shell_state: ShellState = None  # None when a cell could have changed it
+    
+    checker: SyntaxChecker = None
+    
+    man_pages: ManPages
+    
+    token_index: TokenIndex = None  # of the last cell inspected or completed
+    
+    history: History = None  # of executed cells, when enabled
+    
+    metrics: Metrics
+    metrics_textfile_path: Path = None
+    
+    output: OutputCoalescer
+    budget: OutputBudget = None  # of each cell, when limited
+    progress: ProgressCollapser = None  # when redraws are collapsed
+    
+    execution_mode: str
+    run_dir_path: str  # kernel-owned files shared with the shell
+    pipe_readers: list[PipeReader]  # of stdout and stderr of cells when they are not written to the pty
+    request_reader: PipeReader  # of requests of the helpers of helpers.zsh
+    _request_line: str = ""  # start of a request not read completely yet
+    display_files: DisplayFiles
+    store: OutputStore = None  # of the output of executions, when enabled
+    silent: bool = False  # of the current execution
+    cell_deadline: float = None  # time.monotonic() by which the current cell must finish
+    cgroup_path: Path = None  # of the shell when limited
+    notices: list[str]  # problems of the kernel for the user, written to stderr of the next cell
+    shell_output: str = ""  # printed by the shell between cells, written to stdout of the next cell
+    
+    # output is read from the pty by the reader thread and the pipe readers
+    # and queued as (stream name, text) for the publisher in the main thread.
+    # the reader thread ends a request with ("prompt", (pattern index, match, sentinel pattern of the request)).
+    # the request reader queues ("display", (mime type, path, reply path)) and ("out", (execution count, reply path))
+    events: queue.Queue
+    reader: threading.Thread = None
     
     def _init_log_(self, **kwargs):
         self.log_enabled = config["logging_enabled"]
         if self.log_enabled:
-            handler = logging.handlers.WatchedFileHandler(config["logging_file_path"])
-            formatter = logging.Formatter(config["logging_formatter"])
-            handler.setFormatter(formatter)
-            self.log.setLevel(config["logging_level"])
-            self.log.addHandler(handler)
+            pexpect_logger = logging.getLogger("zsh_jupyter_kernel.pexpect")
+            self.log_listener = start_logging(self.log,
+                file_path = config["logging_file_path"],
+                level = config["logging_level"],
+                formatter = config["logging_formatter"],
+                pexpect_logger = pexpect_logger,
+                pexpect_file_path = config["pexpect"]["logging_file_path"],
+                max_bytes = config["logging_max_bytes"],
+                backup_count = config["logging_backup_count"],
+                sampling = config["logging_sampling"],
+            )
+            self.pexpect_logfile = LogWriter(pexpect_logger)
     
-    def _init_spawn_(self, **kwargs):
+    @staticmethod
+    def zsh_args(rcs: bool) -> list[str]:
         args = [
             "-o", "INTERACTIVE",  # just to make sure
             "-o", "NO_ZLE",  # no need for zsh line editor
@@ -54,53 +143,300 @@ class ZshKernel(Kernel):
             "-o", "TRANSIENT_RPROMPT",
             "-o", "NO_PROMPT_CR",
             "-o", "INTERACTIVE_COMMENTS",
+            "-o", "HIST_IGNORE_SPACE",  # requests of the kernel start with a space
         ]  # [zsh-options]
-        if not kwargs.get("rcs", False):
+        if not rcs:
             args.extend(["-o", "NO_RCS"])
-        if self.log_enabled:
-            self.pexpect_logfile = open(config["pexpect"]["logging_file_path"], "a")
+        return args
+    
+    @staticmethod
+    def script(path: str) -> str:
+        """Path of a script of the kernel to run, its zcompiled copy unless disabled."""
+        zwc_dir_path = config["zsh"]["zwc_dir_path"]
+        return compiled(path, zwc_dir_path) if zwc_dir_path is not None else path
+    
+    @classmethod
+    def init_cmds(cls) -> list[str]:
+        """Commands preparing a new shell for the kernel. Also used by the shell pool."""
+        return [
+            *config["zsh"]["init_cmds"],
+            ". " + shlex.quote(cls.script(config["zsh"]["init_script"])),
+            *map(lambda kv: "{}='{}'".format(*kv), cls.ps.items()),
+            *config["zsh"]["config_cmds"],
+            ". " + shlex.quote(cls.script(config["zsh"]["helpers_script"])),
+        ]
+    
+    def _init_spawn_(self, **kwargs):
+        pool_socket_path = config["zsh"]["pool"]["socket_path"]
+        if pool_socket_path is not None:
+            shell = take_shell(pool_socket_path, config["zsh"]["pool"]["timeout"])
+            if shell is not None:
+                (fd, pid, self.pool_env) = shell
+                if self.log_enabled:
+                    self.log.debug("took shell %s from the pool", pid)
+                self.p = PooledShell(fd, pid,
+                    encoding = config["pexpect"]["encoding"],
+                    codec_errors = config["pexpect"]["codec_errors"],
+                    timeout = config["pexpect"]["timeout"],
+                    maxread = config["pexpect"]["maxread"],
+                    searchwindowsize = config["pexpect"]["searchwindowsize"],
+                    logfile = self.pexpect_logfile,
+                )
+                return
+            if self.log_enabled:
+                self.log.warning("shell pool at %s is not available", pool_socket_path)
         self.p = pexpect.spawn(
             "zsh",
-            args,
+            self.zsh_args(kwargs.get("rcs", False)),
             echo = False,
             encoding = config["pexpect"]["encoding"],
             codec_errors = config["pexpect"]["codec_errors"],
             timeout = config["pexpect"]["timeout"],
+            maxread = config["pexpect"]["maxread"],
+            searchwindowsize = config["pexpect"]["searchwindowsize"],
             logfile = self.pexpect_logfile,
         )
     
     def _init_zsh_(self, **kwargs):
-        init_cmds = [
-            *config["zsh"]["init_cmds"],
-            *map(lambda kv: "{}='{}'".format(*kv), self.ps.items()),
-        ]
-        self.p.sendline("; ".join(init_cmds))
-        self.p.expect_exact(self.ps["PS1"])
-        config_cmds = [
-            *config["zsh"]["config_cmds"],
-        ]
-        self.p.sendline("; ".join(config_cmds))
-        self.p.expect_exact(self.ps["PS1"])
+        """
+        Sends all initialization in a single request. Its prompt is awaited
+        only before the next request, so the kernel answers `kernel_info_request`s
+        while zsh and its rc files are still starting.
+        A shell from the pool is initialized already and only needs the cwd and environment of the kernel.
+        """
+        if self.pool_env is not None:
+            cmds = sync_cmds(os.getcwd(), dict(os.environ), self.pool_env)
+        else:
+            cmds = self.init_cmds()
+        cmds.append("export ZSH_JUPYTER_KERNEL_REQUESTS=" + shlex.quote(os.path.join(self.run_dir_path, "requests")))
+        cmds.append("export ZSH_JUPYTER_KERNEL_OUTPUTS=" + shlex.quote(os.path.join(self.run_dir_path, "outputs")))
+        if config["kernel"]["limits"]["ulimit"]:
+            cmds.append("ulimit " + config["kernel"]["limits"]["ulimit"])
+        self._sendline(self._source_line("setup.zsh", "\n".join(cmds)))
+        self.zsh_starting = True
+    
+    def _source_line(self, name: str, code: str) -> str:
+        """
+        Writes `code` to the file `name` in the run dir and returns a short line sourcing it.
+        Lines longer than the input limit of the terminal, 4096 bytes on Linux and 1024 on macOS,
+        would be cut off and leave the shell waiting for the rest of them.
+        """
+        path = os.path.join(self.run_dir_path, name)
+        with open(path, "w") as f:
+            f.write(code + "\n")
+        return ". " + shlex.quote(path)
+    
+    def _sendline(self, line: str):
+        """
+        Sends `line` as a new request. The sentinel of the prompt after it
+        carries a fresh nonce so that no output can be mistaken for it.
+        Lines continuing a request must be sent with `p.sendline`.
+        Requests are kept out of the history of the shell, see init.zsh.
+        """
+        if self.zsh_starting:
+            self.zsh_starting = False
+            self._expect_prompt()
+            if self.log_enabled:
+                self.log.debug("zsh initialized")
+        nonce = secrets.token_hex(8)
+        self.sentinel_re = re.compile(re.escape(nonce) + r":(\d+):([\d,]*):([\d.]+);")
+        self.p.sendline(f" __zsh_jupyter_kernel_nonce={nonce}; {line}")
+    
+    def _expect_prompt(self):
+        self.p.expect(self.sentinel_re)
+        self.metrics.count("expect_iterations")
+        self._set_last_status(self.p.match)
+    
+    def _set_last_status(self, match: re.Match):
+        self.last_status = {
+            "exit_status": int(match.group(1)),
+            "pipestatus": [int(x) for x in match.group(2).split(",") if x],
+            "elapsed": float(match.group(3)),
+        }
+    
+    def _init_limits_(self, **kwargs):
+        """Moves the shell and so all processes of cells into a cgroup with CPU and memory limits."""
+        lc = config["kernel"]["limits"]
+        if lc["cgroup_path"] is None:
+            return
+        self.cgroup_path = Path(lc["cgroup_path"]) / f"zsh-jupyter-kernel-{os.getpid()}"
+        limits = [(controller, value) for (controller, value) in (("cpu", lc["cpu_max"]), ("memory", lc["memory_max"]))
+            if value]
+        try:
+            if limits:
+                # the files of a controller exist in the child cgroup only once it is enabled for it
+                (self.cgroup_path.parent / "cgroup.subtree_control").write_text(
+                    " ".join("+" + controller for (controller, _) in limits))
+            self.cgroup_path.mkdir(exist_ok = True)
+            for (controller, value) in limits:
+                (self.cgroup_path / f"{controller}.max").write_text(value)
+            (self.cgroup_path / "cgroup.procs").write_text(str(self.p.pid))
+        except OSError as e:
+            if self.log_enabled:
+                self.log.warning("could not limit the shell with cgroup %s: %r", self.cgroup_path, e)
+            self.notices.append(f"could not limit the shell with cgroup {self.cgroup_path}: {e}")
+    
+    def _init_execution_(self, **kwargs):
+        self.execution_mode = config["kernel"]["execution"]["mode"]
+        self.run_dir_path = tempfile.mkdtemp(prefix = "zsh-jupyter-kernel-")
+        self.events = queue.Queue()
+        fifo_path = os.path.join(self.run_dir_path, "requests")
+        os.mkfifo(fifo_path, 0o600)
+        self.request_reader = PipeReader(fifo_path, "requests", self._queue_requests,
+            encoding = "utf-8", errors = "surrogateescape")
+        self.request_reader.start()
+        dc = config["kernel"]["display"]
+        self.display_files = DisplayFiles(maxsize = dc["maxsize"], cache_maxbytes = dc["cache_maxbytes"])
+        if config["kernel"]["outputs"]["store"]:
+            self.store = OutputStore(os.path.join(self.run_dir_path, "outputs"),
+                maxbytes = config["kernel"]["outputs"]["maxbytes"])
+        if config["kernel"]["execution"]["streams"] == "pipes":
+            if self.execution_mode != "cell":
+                if self.log_enabled:
+                    self.log.warning("stream pipes need the cell execution mode")
+                return
+            for name in ("stdout", "stderr"):
+                fifo_path = os.path.join(self.run_dir_path, name)
+                os.mkfifo(fifo_path, 0o600)
+                reader = PipeReader(fifo_path, name, self._queue_output,
+                    encoding = config["pexpect"]["encoding"],
+                    errors = config["pexpect"]["codec_errors"],
+                    size = config["kernel"]["execution"]["pipe_read_size"],
+                )
+                reader.start()
+                self.pipe_readers.append(reader)
+    
+    def _init_output_(self, **kwargs):
+        oc = config["kernel"]["output"]
+        self.output = OutputCoalescer(
+            self._send_stream,
+            maxsize = oc["flush_size"],
+            interval = oc["flush_interval"],
+        )
+        if oc["cell_limit"] > 0:
+            self.budget = OutputBudget(
+                self.output.write,
+                maxsize = oc["cell_limit"],
+                tail_size = oc["tail_size"],
+                spill_dir = oc["spill_dir_path"],
+            )
+            threading.Thread(target = self.budget.prune, args = (oc["spill_ttl"],),
+                name = "spill-pruner", daemon = True).start()
+        pc = oc["progress"]
+        if pc["enabled"]:
+            self.progress = ProgressCollapser(self._write_stream, self._send_progress,
+                interval = pc["interval"], maxrows = pc["maxrows"], maxcols = pc["maxcols"], maxsize = pc["maxsize"])
+    
+    def _init_metrics_(self, **kwargs):
+        self.metrics = Metrics()
+        mc = config["kernel"]["metrics"]
+        if mc["textfile_dir_path"] is None:
+            return
+        self.metrics_textfile_path = Path(mc["textfile_dir_path"]) / f"zsh_jupyter_kernel_{os.getpid()}.prom"
+        threading.Thread(target = self._write_metrics_textfile, args = (mc["textfile_interval"],),
+            name = "metrics-writer", daemon = True).start()
+    
+    def _write_metrics_textfile(self, interval: float):
+        while True:
+            try:
+                self.metrics.write_textfile(self.metrics_textfile_path, {"pid": str(os.getpid())})
+            except OSError as e:
+                if self.log_enabled:
+                    self.log.warning("could not write metrics: %r", e)
+            time.sleep(interval)
+    
+    def _init_completer_(self, **kwargs):
+        cc = config["kernel"]["code_completion"]
+        if not cc["worker"]:
+            return
+        self.completer = CompletionWorker(
+            self.script(cc["worker_script"]),
+            start_timeout = cc["worker_start_timeout"],
+            timeout = cc["worker_timeout"],
+            log = self.log if self.log_enabled else None,
+        )
+        self.completer.start()  # warms up while the user is still typing
+        if cc["cache"]["enabled"]:
+            self.completion_cache = LRUCache(maxsize = cc["cache"]["maxsize"], ttl = cc["cache"]["ttl"])
+    
+    def _init_checker_(self, **kwargs):
+        sc = config["kernel"]["syntax_check"]
+        self.checker = SyntaxChecker(
+            self.script(sc["script"]),
+            start_timeout = sc["start_timeout"],
+            timeout = sc["timeout"],
+            log = self.log if self.log_enabled else None,
+        )
+        self.checker.start()
+    
+    def _init_inspection_(self, **kwargs):
+        ic = config["kernel"]["inspection"]
+        self.man_pages = ManPages(
+            ic["cmd"],
+            width = ic["width"],
+            maxbytes = ic["maxbytes"],
+            disk_dir = ic["disk_dir_path"],
+            disk_ttl = ic["disk_ttl"],
+            timeout = ic["timeout"],
+            log = self.log if self.log_enabled else None,
+        )
+        threading.Thread(target = self.man_pages.prune, name = "man-page-pruner", daemon = True).start()
+    
+    def _init_history_(self, **kwargs):
+        hc = config["kernel"]["history"]
+        if not hc["enabled"]:
+            return
+        try:
+            self.history = History(hc["file_path"], timeout = hc["timeout"],
+                log = self.log if self.log_enabled else None)
+        except (OSError, sqlite3.Error) as e:
+            if self.log_enabled:
+                self.log.warning("history is not available: %r", e)
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.pipe_readers = []
+        self.notices = []
         self._init_log_()
+        self._init_metrics_()
         if self.log_enabled:
             self.log.debug("initializing %s", json.dumps(config, indent = 4))
         self._init_spawn_()
+        self._init_execution_()
         self._init_zsh_(**kwargs)
+        self._init_limits_()
+        self._init_output_()
+        self._init_completer_()
+        self._init_checker_()
+        self._init_inspection_()
+        self._init_history_()
         # self.p.sendline("tty")
         # self.p.expect_exact(self.ps['PS1'])
         if self.log_enabled:
             self.log.debug("initialized")
         if self.log_enabled:
-            self.log.debug("kwargs:" + str(kwargs))
+            self.log.debug("kwargs: %s", kwargs)
     
-    def __del__(self):
-        try:
-            self.pexpect_logfile.close()
-        except AttributeError:
-            pass
+    def do_shutdown(self, restart):
+        for worker in (self.completer, self.checker):
+            if worker is not None:
+                worker.stop()
+        for reader in [*self.pipe_readers, self.request_reader]:
+            reader.close()
+        shutil.rmtree(self.run_dir_path, ignore_errors = True)
+        if self.metrics_textfile_path is not None:
+            self.metrics_textfile_path.unlink(missing_ok = True)
+        self.p.close()
+        if self.cgroup_path is not None:
+            try:
+                self.cgroup_path.rmdir()
+            except OSError:
+                pass  # processes of the shell are still exiting
+        if self.history is not None:
+            self.history.close()
+        if self.log_listener is not None:
+            self.log_listener.stop()  # writes the records still queued
+        return super().do_shutdown(restart)
     
     def kernel_info_request(self, stream, ident, parent):
         content = {"status": "ok"}
@@ -110,68 +446,426 @@ class ZshKernel(Kernel):
         if self.log_enabled:
             self.log.debug("info request sent: %s", msg)
     
-    def _execute_line(self, line, silent):
+    def metrics_request(self, stream, ident, parent):
+        content = {"status": "ok", **self.metrics.snapshot()}
+        self.session.send(stream, "metrics_reply", content, parent, ident)
+    
+    def _send_stream(self, name: str, text: str):
+        self.send_response(self.iopub_socket, "stream", {"name": name, "text": text})
+    
+    def _queue_output(self, name: str, text: str):
+        self.metrics.count("read_characters:" + name, len(text))
+        self.events.put((name, text))
+    
+    def _queue_requests(self, name: str, text: str):
+        (*lines, self._request_line) = (self._request_line + text).split("\n")
+        for line in lines:
+            (helper, *args) = line.split("\t")
+            if {"display": 3, "out": 2}.get(helper) == len(args):
+                self.events.put((helper, tuple(args)))
+            elif self.log_enabled:
+                self.log.warning("unknown request: %r", line)
+    
+    def _drain_pipes(self):
+        """Queues what commands of the finished request left in the pipes."""
+        for reader in [*self.pipe_readers, self.request_reader]:
+            reader.drain()
+    
+    def _read_until_prompt(self, patterns: list):
+        """
+        Runs in the reader thread. Queues the output of the current request
+        and finally the index of the prompt pattern which ended it.
+        Output is queued by lines, and long lines in chunks, rather than collected in `p.before`.
+        """
+        try:
+            (actual, match, rest, reads) = read_until(
+                lambda: self.p.read_nonblocking(self.p.maxread),
+                patterns,
+                self._queue_pty_output,
+                chunk_size = config["kernel"]["output"]["chunk_size"],
+                window = config["pexpect"]["searchwindowsize"],
+                text = self._swap_pty_buffer(""),
+            )
+            self._swap_pty_buffer(rest)
+            self.metrics.count("expect_iterations", reads + 1)
+            self.events.put(("prompt", (actual, match, patterns[0])))
+        except BaseException as e:
+            self.events.put(("error", e))
+    
+    def _queue_pty_output(self, text: str):
+        if self.log_enabled:
+            self.log.debug("output: %s", text, extra = {"category": "output"})
+        self.metrics.count("read_characters:pty", len(text))
+        self.events.put(("stdout", text))
+    
+    def _swap_pty_buffer(self, text: str) -> str:
+        """Returns the text read from the terminal which `p.expect` did not match yet and leaves `text` instead."""
+        rest = self.p.buffer
+        self.p.buffer = text
+        # pexpect takes `before` from its untrimmed copy of the buffer
+        self.p._before = self.p.buffer_type()
+        self.p._before.write(text)
+        return rest
+    
+    def _publish(self, name: str, text: str):
+        if name == "display":
+            self._display(*text)
+            return
+        if name == "out":
+            self._reply_out(*text)
+            return
+        if self.silent:
+            return
+        if self.store is not None:
+            self.store.write(text)
+        if self.progress is not None:
+            self.progress.write(name, text)
+        else:
+            self._write_stream(name, text)
+    
+    def _write_stream(self, name: str, text: str):
+        if self.budget is not None:
+            self.budget.write(name, text)
+        else:
+            self.output.write(name, text)
+    
+    def _send_progress(self, display_id: str, text: str, update: bool) -> bool:
+        if self.budget is not None and not self.budget.allow(len(text)):
+            return False  # written as stream text instead, which the budget truncates
+        self.output.flush()  # keeps the order of stream output before it
+        self.send_response(self.iopub_socket, "update_display_data" if update else "display_data",
+            {"data": {"text/plain": text}, "metadata": {}, "transient": {"display_id": display_id}})
+        return True
+    
+    def _display(self, mime: str, path: str, reply_path: str):
+        """
+        Sends the file at `path` as display_data and replies to the helper once it is read,
+        with nothing or the error which kept it from being read.
+        """
+        # helper files holding stdin of `display` are removed once read.
+        # the helper sends resolved paths, and the run directory may be behind a symlink like /var on macOS
+        temporary = os.path.realpath(os.path.dirname(path)) == os.path.realpath(self.run_dir_path)
+        error = ""
+        try:
+            if self.silent:
+                return
+            bundle = self.display_files.bundle(path, mime, cache = not temporary)
+        except (OSError, ValueError) as e:
+            error = str(e)
+            return
+        finally:
+            if temporary:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            threading.Thread(target = self._reply, args = (reply_path, error),
+                name = "display-reply", daemon = True).start()
+        self.output.flush()  # keeps the order of stream output before it
+        self.send_response(self.iopub_socket, "display_data", {"data": bundle, "metadata": {}, "transient": {}})
+    
+    def _reply_out(self, n: str, reply_path: str):
+        """Moves the stored output of execution `n` to a file and replies with its path, or nothing."""
+        path = None
+        if self.store is not None:
+            try:
+                path = self.store.spill(int(n))
+            except OSError as e:
+                if self.log_enabled:
+                    self.log.warning("could not store output %s: %r", n, e)
+        threading.Thread(target = self._reply, args = (reply_path, str(path or "")),
+            name = "out-reply", daemon = True).start()
+    
+    def _reply(self, fifo_path: str, text: str):
+        """
+        Runs in a thread. Writes `text` to the fifo of a helper once it is open for reading,
+        so a helper which was interrupted before reading does not block anything.
+        """
+        deadline = time.monotonic() + config["kernel"]["outputs"]["reply_timeout"]
+        while True:
+            try:
+                fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO or time.monotonic() > deadline:  # ENXIO: no reader yet
+                    return
+                time.sleep(0.01)
+        with open(fd, "w") as f:
+            f.write(text)
+    
+    def _publish_until_prompt(self, deadline: float = None) -> Optional[tuple[int, re.Match]]:
+        """
+        Sends queued output while the reader thread reads the current request.
+        Returns None if the request did not end by the `deadline` as `time.monotonic()`.
+        """
+        while True:
+            timeout = self.output.timeout()
+            if self.progress is not None:
+                due = self.progress.timeout()
+                timeout = due if timeout is None else timeout if due is None else min(timeout, due)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            try:
+                (name, value) = self.events.get(timeout = timeout)
+            except queue.Empty:
+                if self.progress is not None:
+                    self.progress.flush()
+                self.output.flush()
+                continue
+            if name == "prompt":
+                (actual, match, sentinel_re) = value
+                if sentinel_re is not self.sentinel_re:
+                    continue  # of a reader of an earlier request
+                return (actual, match)
+            if name == "error":
+                raise value
+            self._publish(name, value)
+    
+    def _publish_pending(self):
+        """Sends output queued after the prompt, e.g. by the pipe readers."""
+        self._drain_pipes()
+        while True:
+            try:
+                (name, value) = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if name in ("stdout", "stderr", "display", "out"):  # not the prompt of an interrupted request
+                self._publish(name, value)
+        self.output.flush()
+    
+    @timed("execute_line")
+    def _execute_line(self, line, silent, continued = False):
         if self.log_enabled:
             self.log.debug("code: %s", line)
-        self.p.sendline(line)
-        actual = self.p.expect(list(self.ps_re.values()) + [os.linesep])
+        if self.reader is not None and self.reader.is_alive():
+            # the previous request still runs, e.g. when its interrupt was interrupted.
+            # a second reader would split the output of the pty with it
+            self._interrupt()
+        if continued:
+            self.p.sendline(line)
+        else:
+            self._sendline(line)
+        patterns = [self.sentinel_re, *self.ps_re.values()]
+        self.reader = threading.Thread(target = self._read_until_prompt, args = (patterns,),
+            name = "pty-reader", daemon = True)
+        self.reader.start()
+        result = self._publish_until_prompt(self.cell_deadline)
+        if result is None:
+            raise CellTimeoutError(f"the cell did not finish within {config['kernel']['limits']['cell_timeout']} s")
+        (actual, match) = result
         if actual == 0:
+            self._set_last_status(match)
             if self.log_enabled:
-                self.log.debug(f"got PS1. output: {self.p.before}")
-            if not silent:
-                if len(self.p.before) != 0:
-                    self.send_response(self.iopub_socket,
-                        "stream", {"name": "stdout", "text": self.p.before})
-        else:
-            while actual == 3:
-                if self.log_enabled:
-                    self.log.debug(f"got linesep. output: {self.p.before}")
-                if not silent:
-                    self.send_response(self.iopub_socket,
-                        "stream", {"name": "stdout", "text": self.p.before + os.linesep})
-                actual = self.p.expect(list(self.ps_re.values()) + [os.linesep])
+                self.log.debug("got prompt %s", self.last_status)
+            self._publish_pending()
         return actual
     
-    def _execute_code(self, code, silent):
+    def _execute_cell(self, code, silent, history_cmd = ""):
+        """Sources the whole cell in the current shell with a single prompt round-trip."""
+        cell_file_path = os.path.join(self.run_dir_path, "cell.zsh")
+        with open(cell_file_path, "w") as f:
+            f.write(history_cmd)  # on the first line of the cell, so its line numbers stay the same
+            f.write(code)
+            # the pipestatus of `.` itself is not interesting
+            f.write("\n__zsh_jupyter_kernel_status=$? __zsh_jupyter_kernel_pipestatus=( $pipestatus )"
+                    "; return $__zsh_jupyter_kernel_status\n")
+        line = ". " + shlex.quote(cell_file_path)
+        if self.pipe_readers:
+            # the pty stays stdin for interactive programs
+            line += "".join(f" {fd}>" + shlex.quote(os.path.join(self.run_dir_path, name))
+                for fd, name in ((1, "stdout"), (2, "stderr")))
+        return self._execute_line(line, silent)
+    
+    @staticmethod
+    def _history_cmd(code: str) -> str:
+        """Adds `code` to the history of the shell. Written on a single line, so it can precede the code."""
+        quoted = re.sub(r"[\\'\x00-\x1f\x7f]",
+            lambda m: "\\" + m.group() if m.group() in "\\'" else f"\\x{ord(m.group()):02x}", code)
+        return f"print -sr -- $'{quoted}'; "
+    
+    def _execute_code(self, code, silent, store_history = False):
         actual = None
-        for line in code.splitlines():
-            actual = self._execute_line(line, silent)
+        # requests are kept out of the history of the shell, so cells are added as they were written
+        history_cmd = self._history_cmd(code) if store_history and not silent else ""
+        parallel = parse_magic(code)
+        if not code.strip():
+            pass
+        elif parallel is not None:
+            self._execute_parallel(*parallel, silent, history_cmd)
+        elif self.execution_mode == "cell":
+            actual = self._execute_cell(code, silent, history_cmd)
+        else:
+            for line in code.splitlines():
+                if actual is None and history_cmd:
+                    # sourced, as the whole cell may be longer than the input limit of the terminal
+                    line = self._source_line("history.zsh", history_cmd) + "; " + line
+                actual = self._execute_line(line, silent, continued = actual in [1, 2])
+                if actual == 0 and self._failed():
+                    break
         if self.log_enabled:
-            self.log.debug(f"executed all lines. actual: {actual}")
+            self.log.debug("executed all lines. actual: %s", actual)
         if actual in [1, 2]:
             self.p.sendline()
             # "flushing"
-            actual = self.p.expect(list(self.ps_re.values()))
+            patterns = [self.sentinel_re, *self.ps_re.values()]
+            actual = self.p.expect(patterns)
             while actual != 0:
-                actual = self.p.expect(list(self.ps_re.values()) + [re.compile(".*")])
+                actual = self.p.expect(patterns + [re.compile(".*")])
             if not silent:
-                self.send_response(self.iopub_socket,
-                    "stream", {"name": "stdout", "text": self.p.before})
+                self.output.write("stdout", self.p.before)
+                self.output.flush()
             raise ValueError("Continuation or selection prompts are not handled yet")
+        if self._failed():
+            raise ExitStatusError(f"exit status {self.last_status['exit_status']}")
+    
+    def _get_environ(self, history_cmd: str = "") -> tuple[str, dict[str, str]]:
+        """
+        The cwd and exported variables of the shell.
+        Asked for from a file, as the history command carries the whole cell.
+        """
+        environ_path = os.path.join(self.run_dir_path, "environ")
+        # the value is quoted, as an unquoted empty one would be dropped and shift the pairs after it
+        self._sendline(self._source_line("environ.zsh", history_cmd + "{ print -rN -- \"$PWD\"; "
+            "for k in ${(k)parameters[(R)*export*]}; print -rN -- $k \"${(P)k}\"; } > " + shlex.quote(environ_path)))
+        self._expect_prompt()
+        with open(environ_path, "rb") as f:
+            (cwd, *items) = f.read().decode(errors = "surrogateescape").split("\0")[:-1]
+        os.unlink(environ_path)
+        return (cwd, dict(zip(items[::2], items[1::2])))
+    
+    def _execute_parallel(self, jobs: Optional[int], cmds: list[str], silent: bool, history_cmd: str = ""):
+        """Runs the commands of a `%%parallel` cell on processes inheriting the cwd and environment of the shell."""
+        (cwd, env) = self._get_environ(history_cmd)
+        run = ParallelRun(cmds, jobs or config["kernel"]["parallel"]["jobs"], cwd, env,
+            encoding = config["pexpect"]["encoding"],
+            errors = config["pexpect"]["codec_errors"],
+            maxbuffer = config["kernel"]["parallel"]["maxbuffer"],
+        )
+        start = time.monotonic()
+        try:
+            finished = run.run(self._publish, self.cell_deadline)
+        except OSError as e:  # e.g. the cwd of the shell was removed or no more processes are allowed
+            raise ParallelError(f"could not start the commands in {cwd}: {e}") from e
+        results = [
+            {"line": i + 1, "command": cmd, **(result or {"exit_status": None, "elapsed": None})}
+            for (i, (cmd, result)) in enumerate(zip(cmds, run.results))
+        ]
+        statuses = [result["exit_status"] for result in results]
+        self.last_status = {
+            "exit_status": next((status for status in statuses if status), 0),
+            "pipestatus": [],
+            "elapsed": time.monotonic() - start,
+            "parallel": results,
+        }
+        if not finished:
+            raise CellTimeoutError(f"the cell did not finish within {config['kernel']['limits']['cell_timeout']} s")
+    
+    def _failed(self) -> bool:
+        return config["kernel"]["execution"]["fail_on_error"] \
+            and self.last_status is not None and self.last_status["exit_status"] != 0
+    
+    def _interrupt(self):
+        """Stops the current request. Further interrupts meanwhile only speed up the escalation."""
+        if self.reader is not None and self.reader.is_alive():
+            # otherwise the shell is already waiting for the next line
+            if not self._stop_foreground():
+                self._restart_shell()
+        self._publish_pending()
+    
+    def _stop_foreground(self) -> bool:
+        """
+        Signals the foreground process group of the shell on the schedule of the config
+        until the shell prints its prompt. Returns False if it did not.
+        """
+        for (signal_name, grace) in config["kernel"]["limits"]["interrupt_schedule"]:
+            if signal_name == "SIGINT":
+                self.p.sendintr()
+            else:
+                try:
+                    group = os.tcgetpgrp(self.p.child_fd)
+                    if group == self.p.pid:
+                        continue  # the shell itself is busy. it is restarted when SIGINT does not help
+                    os.killpg(group, getattr(signal, signal_name))
+                except OSError:
+                    continue
+            if self.log_enabled:
+                self.log.debug("sent %s to the foreground process group", signal_name)
+            try:
+                if self._publish_until_prompt(time.monotonic() + grace) is not None:
+                    return True
+            except KeyboardInterrupt:
+                continue  # interrupted again, so the next signal is sent right away
+            except pexpect.EOF:
+                return False
+        return False
+    
+    def _restart_shell(self):
+        if self.log_enabled:
+            self.log.warning("the shell did not return after the interrupt. restarting it")
+        self.metrics.count("shell_restarts")
+        self.p.close()
+        self.reader.join(1)  # its error about the closed shell is dropped with the pending output
+        self.pool_env = None
+        self._init_spawn_()
+        self._init_zsh_()
+        self._init_limits_()
+        self.output.write("stderr", "\n[the shell did not respond to signals and was restarted]\n")
     
     def _get_error_response(self, exc):
         return {
             "execution_count": self.execution_count,
             "ename": exc.__class__.__name__,
-            "evalue": exc.__class__.__name__,
+            "evalue": str(exc) or exc.__class__.__name__,
             "traceback": [],
             # 'traceback': traceback.extract_stack(exc),
         }
     
+    @timed("execute")
     def do_execute(self, code: str, silent: bool, store_history = True,
             user_expressions: dict = None, **kwargs):
+        self.shell_state = None
+        self.last_status = None
+        self.silent = silent
+        cell_timeout = config["kernel"]["limits"]["cell_timeout"]
+        self.cell_deadline = time.monotonic() + cell_timeout if cell_timeout > 0 else None
+        if self.budget is not None:
+            self.budget.start(f"{os.path.basename(self.run_dir_path)}-{self.execution_count}")
+        if self.store is not None and not silent:
+            self.store.start(self.execution_count)  # counted before do_execute unless silent
+        if self.history is not None and store_history and not silent:
+            self.history.add(self.execution_count, code)
+        if self.notices and not silent:
+            self.output.write("stderr", "".join(f"[{notice}]\n" for notice in self.notices))
+            self.notices = []
+        if self.shell_output and not silent:
+            self._publish("stdout", self.shell_output)
+            self.shell_output = ""
         try:
-            self._execute_code(code, silent)
+            try:
+                self._execute_code(code, silent, store_history)
+            except KeyboardInterrupt:
+                if self.log_enabled: self.log.debug("interrupted by user")
+                self._interrupt()
+                raise
+            except CellTimeoutError:
+                if self.log_enabled: self.log.debug("cell timed out")
+                self._interrupt()
+                raise
+            finally:
+                if self.progress is not None:
+                    self.progress.finish()
+                if self.budget is not None:
+                    self.budget.finish()
+                if self.store is not None:
+                    self.store.finish()
+                self.output.flush()
         except KeyboardInterrupt as exc:
-            if self.log_enabled: self.log.debug("interrupted by user")
-            self.p.sendintr()
-            self.p.expect_exact(self.ps["PS1"])
-            if not silent:
-                self.send_response(self.iopub_socket, "stream",
-                    {"name": "stdout", "text": self.p.before})
             error_response = self._get_error_response(exc)
             return {"status": "error", **error_response}
-        except ValueError as exc:
+        except (ValueError, ExitStatusError, CellTimeoutError, ParallelError) as exc:
             if self.log_enabled: self.log.exception("value error")
             error_response = self._get_error_response(exc)
             self.send_response(self.iopub_socket, "error", error_response)
@@ -187,7 +881,7 @@ class ZshKernel(Kernel):
             self.send_response(self.iopub_socket, "error", error_response)
             return {"status": "error", **error_response}
         
-        if self.log_enabled: self.log.debug(f"success {self.execution_count}")
+        if self.log_enabled: self.log.debug("success %s", self.execution_count)
         return {
             "status": "ok",
             "execution_count": self.execution_count,
@@ -195,44 +889,80 @@ class ZshKernel(Kernel):
             "user_expressions": {},
         }
     
+    def do_history(self, hist_access_type: str, output: bool, raw: bool, session: int = None,
+            start: int = None, stop: int = None, n: int = None, pattern: str = None, unique: bool = False):
+        if self.history is None:
+            return {"status": "ok", "history": []}
+        try:
+            if hist_access_type == "tail":
+                rows = self.history.tail(n, unique)
+            elif hist_access_type == "range":
+                rows = self.history.range(session or 0, start or 0, stop)
+            elif hist_access_type == "search":
+                rows = self.history.search(pattern, n, unique)
+            else:
+                rows = []
+        except sqlite3.Error as e:
+            if self.log_enabled:
+                self.log.warning("could not read history: %r", e)
+            rows = []
+        if output:  # outputs are not recorded
+            rows = [(session, line, (source, None)) for (session, line, source) in rows]
+        return {"status": "ok", "history": rows}
+    
+    def finish_metadata(self, parent, metadata, reply_content):
+        metadata = super().finish_metadata(parent, metadata, reply_content)
+        if self.last_status is not None:
+            metadata.update(self.last_status)
+        return metadata
+    
+    @timed("is_complete")
     def do_is_complete(self, code: str):
-        (_, exitstatus) = pexpect.run(
-            "zsh -nc '{}'".format(code),
-            withexitstatus = True,
-        )
-        if exitstatus == 0:
-            return {"status": "complete"}
-        elif exitstatus == 1:
-            return {"status": "incomplete"}
+        reply = self.checker.is_complete(code)
+        if self.log_enabled:
+            self.log.debug("is complete: %s", reply)
+        return reply
     
+    @timed("inspect")
     def do_inspect(self, code: str, cursor_pos: int, detail_level: int = 0,
             omit_sections = ()):
-        word = find_word_at_pos(code, cursor_pos)
+        word = self._find_command_word(code, cursor_pos)
         if self.log_enabled:
             self.log.debug("inspecting: %s", word)
-        cman = f"man --pager ul {word}"
-        res = pexpect.run(cman).decode()
+        page = self.man_pages.render(word) if word else None
         return {
             "status": "ok",
-            "found": True,
-            "data": {"text/plain": res},
+            "found": page is not None,
+            "data": {"text/plain": page} if page is not None else {},
             "metadata": {},
         }
     
-    @staticmethod
-    def _parse_completee(code: str, cursor_pos: int) -> tuple:
+    def _get_token_index(self, code: str) -> TokenIndex:
+        """Frontends send the same cell with each keystroke, so the index of the last one is kept."""
+        if self.token_index is None or self.token_index.code != code:
+            self.token_index = TokenIndex(code)
+        return self.token_index
+    
+    def _find_command_word(self, code: str, cursor_pos: int) -> str:
+        """The word at the cursor if it is a command, otherwise the command it is an argument of."""
+        index = self._get_token_index(code)
+        token = index.at(cursor_pos)
+        if token is None:
+            return ""
+        if token.kind in ("argument", "redirect") and token.command >= 0:
+            token = index.command_of(token)
+        return unquote(index.text(token))
+    
+    def _parse_completee(self, code: str, cursor_pos: int) -> tuple:
         context = code[:cursor_pos]
-        match = re.search(r"\S+$", context)
-        if not match:
-            match = re.search(r"\w+$", context)
-        if not match:
-            completee = ""
-        else:
-            completee = match.group(0)
-        cursor_start = cursor_pos - len(completee)
+        index = self._get_token_index(code)
+        token = index.at(cursor_pos)
+        cursor_start = cursor_pos if token is None else index.word_start(token, cursor_pos)
+        completee = code[cursor_start:cursor_pos]
         cursor_end = cursor_pos
         return context, completee, cursor_start, cursor_end
     
+    @timed("complete")
     def do_complete(self, code: str, cursor_pos: int):
         if self.log_enabled:
             self.log.debug("received code to complete:\n%s", code)
@@ -243,18 +973,10 @@ class ZshKernel(Kernel):
         if self.log_enabled:
             self.log.debug("parsed completee: %s",
                 (context, completee, cursor_start, cursor_end))
-        completion_cmd = config["kernel"]["code_completion"]["cmd"].format(context)
-        self.p.sendline(completion_cmd)
-        self.p.expect_exact(self.ps["PS1"])
-        raw_completions = self.p.before.strip()
-        if self.log_enabled:
-            self.log.debug("got completions:\n%s", raw_completions)
-        completions = list(filter(None, raw_completions.splitlines()))
-        if self.log_enabled:
-            self.log.debug("array of completions: %s", completions)
-        matches_data = list(
-            map(lambda x: x.split(" -- "), completions)
-        )  # [match, description]
+        if self.completer is not None:
+            matches_data = self._complete_in_worker(context)
+        else:
+            matches_data = self._complete_in_shell(context)
         if self.log_enabled:
             self.log.debug("processed matches: %s", matches_data)
         return {
@@ -262,12 +984,60 @@ class ZshKernel(Kernel):
             "matches": [x[0] for x in matches_data],
             "cursor_start": cursor_start,
             "cursor_end": cursor_end,
-            "metadata": {},
+            "metadata": {
+                "_jupyter_types_experimental": [
+                    {"start": cursor_start, "end": cursor_end, "text": match, "signature": description}
+                    for match, description in matches_data
+                ],
+            },
         }
     
+    def _complete_in_worker(self, context: str) -> list:
+        state = self._get_shell_state()
+        if self.completion_cache is None:
+            return self.completer.complete(state, context)
+        key = (CompletionWorker.line(context), state)
+        matches_data = self.completion_cache.get(key)
+        if matches_data is not None:
+            if self.log_enabled:
+                self.log.debug("completion cache hit")
+            return matches_data
+        matches_data = self.completer.complete(state, context)
+        if matches_data:  # an empty result may as well be a failed worker
+            self.completion_cache.put(key, matches_data)
+        return matches_data
+    
+    def _complete_in_shell(self, context: str) -> list:
+        cc = config["kernel"]["code_completion"]
+        completion_cmd = cc["cmd"].format(script = self.script(cc["capture_script"]), context = context)
+        self._sendline(completion_cmd)
+        self._expect_prompt()
+        raw_completions = self.p.before.strip()
+        if self.log_enabled:
+            self.log.debug("got completions:\n%s", raw_completions)
+        completions = list(filter(None, raw_completions.splitlines()))
+        return list(
+            map(lambda x: x.partition(" -- ")[::2], completions)
+        )  # [match, description]
+    
+    def _get_shell_state(self) -> ShellState:
+        if self.shell_state is None:
+            self._sendline(ShellState.query)
+            self._expect_prompt()
+            (before, self.shell_state) = ShellState.parse(self.p.before)
+            self.shell_output += before
+            if self.completion_cache is not None:
+                n = self.completion_cache.evict_if(lambda key: key[1] != self.shell_state)
+                if self.log_enabled:
+                    self.log.debug("shell state %s, evicted %s completions", self.shell_state, n)
+        return self.shell_state
+    
     def send_response(self, stream, msg_or_type, content = None, ident = None,
             buffers = None, track = False, header = None, metadata = None, channel = None):
         if self.log_enabled:
-            self.log.debug("sending response: %s", msg_or_type)
+            self.log.debug("sending response: %s", msg_or_type,
+                extra = {"category": "output" if msg_or_type == "stream" else None})
+        msg_type = msg_or_type if isinstance(msg_or_type, str) else msg_or_type["header"]["msg_type"]
+        self.metrics.count("messages_sent:" + msg_type)
         super().send_response(stream, msg_or_type, content, ident, buffers, track,
             header, metadata, channel)
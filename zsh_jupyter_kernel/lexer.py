@@ -0,0 +1,289 @@
+__all__ = ['Token', 'TokenIndex', 'unquote']
+
+import bisect
+import re
+from typing import NamedTuple, Optional
+
+class Token(NamedTuple):
+    start: int
+    end: int
+    kind: str  # "command", "argument", "assignment", "reserved" or "redirect" (the target of a redirection)
+    parent: int  # index of the word containing a `$( )`, `` ` ` `` or `${ }` with this token or -1
+    command: int  # index of the command word of the simple command of this token or -1
+
+_blank = re.compile(r"(?:[ \t]|\\\n)+")
+_word_chars = re.compile(r"""[^\s;&|<>()'"\\$`]+""")
+_double_quoted_chars = re.compile(r'[^"\\$`]+')
+_brace_chars = re.compile(r"""[^{}\\$'"`]+""")
+_ansi_quoted = re.compile(r"(?:[^'\\]|\\.)*'?", re.S)
+_assignment = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(?:\[[^]]*\])?\+?=")
+_operator = re.compile(r"&&|\|\||;;|;&|;\||\|&|&!|&\||&>>|&>|<<<|<<-|<<|>>|>&|<&|<>|>\||>!|\(\(|[;&|<>()\n]")
+_separators = {"&&", "||", ";;", ";&", ";|", "|", "|&", "&", "&!", "&|", ";", "(", "\n"}
+# reserved words which are followed by a command
+_command_reserved = {"if", "then", "else", "elif", "do", "while", "until", "{", "!", "time", "nocorrect", "noglob", "coproc"}
+_other_reserved = {"fi", "done", "esac", "}", "for", "foreach", "select", "case", "function", "repeat", "in"}
+
+class TokenIndex:
+    """
+    The words of a cell found in a single pass, with lookups by position in O(log n).
+    Understands quoting, parameter expansion, command and arithmetic substitution,
+    comments and heredocs well enough to find the word at the cursor and its command.
+    Words within substitutions are indexed as well, after the word containing them.
+    Substitutions nested deeper than the recursion limit allows are not understood,
+    and the cell is then split into words at blanks only.
+    """
+
+    def __init__(self, code: str):
+        self.code = code
+        self.tokens: list[Optional[Token]] = []
+        self._heredocs: list[tuple[str, bool]] = []  # delimiters of heredocs starting after the current line
+        try:
+            self._commands(0, None, -1)
+        except RecursionError:
+            self.tokens = [Token(m.start(), m.end(), "argument", -1, -1) for m in re.finditer(r"\S+", code)]
+        self._starts = [t.start for t in self.tokens]
+
+    def at(self, pos: int) -> Optional[Token]:
+        """The innermost word at `pos` including its end or None if there is none."""
+        i = bisect.bisect_right(self._starts, pos) - 1
+        while i >= 0:
+            token = self.tokens[i]
+            if token.end >= pos:
+                return token
+            i = token.parent
+        return None
+
+    def text(self, token: Token) -> str:
+        return self.code[token.start:token.end]
+
+    def command_of(self, token: Token) -> Optional[Token]:
+        return self.tokens[token.command] if token.command >= 0 else None
+
+    def word_start(self, token: Token, pos: int) -> int:
+        """Start of the part of `token` before `pos`. Inside an unterminated quote it starts after the quote."""
+        start = token.start
+        quote = None
+        i = token.start
+        while i < pos:
+            c = self.code[i]
+            if c == "\\" and quote != "'":
+                i += 2
+                continue
+            if quote is None and c in "'\"":
+                quote = c
+                start = i + 1
+            elif c == quote:
+                quote = None
+                start = token.start
+            i += 1
+        return start
+
+    def _commands(self, i: int, closer: Optional[str], parent: int) -> int:
+        """Indexes commands from `i` up to `closer` and returns the index after it."""
+        code = self.code
+        n = len(code)
+        command = -1  # index of the command word of the current simple command
+        expect_command = True
+        redirect = False
+        level = 0  # of subshells in this substitution
+        while i < n:
+            m = _blank.match(code, i)
+            if m:
+                i = m.end()
+                continue
+            c = code[i]
+            if c == "`" and closer == "`":
+                return i + 1
+            if c == "#":
+                end = code.find("\n", i)
+                i = n if end < 0 else end
+                continue
+            m = _operator.match(code, i)
+            if m:
+                op = m.group()
+                i = m.end()
+                if op == "\n":
+                    i = self._skip_heredocs(i)
+                elif op == "((":
+                    i = self._skip_arithmetic(i, 2)
+                    expect_command = False
+                    continue
+                elif op == "(":
+                    level += 1
+                elif op == ")":
+                    if level == 0 and closer == ")":
+                        return i
+                    level = max(0, level - 1)
+                    expect_command = False
+                    continue
+                if op in _separators:
+                    expect_command = True
+                    command = -1
+                elif op in ("<<", "<<-"):
+                    m = _blank.match(code, i)
+                    j = m.end() if m else i
+                    k = len(self.tokens)
+                    self.tokens.append(None)
+                    end = self._word(j, closer, k)
+                    if end > j:
+                        self._heredocs.append((unquote(code[j:end]), op == "<<-"))
+                        self.tokens[k] = Token(j, end, "redirect", parent, command)
+                    else:
+                        self.tokens.pop()
+                    i = end
+                else:
+                    redirect = True
+                continue
+            k = len(self.tokens)
+            self.tokens.append(None)  # words of substitutions are indexed after it
+            end = self._word(i, closer, k)
+            if end == i:  # a closer of an outer substitution out of place
+                self.tokens.pop()
+                i += 1
+                continue
+            text = code[i:end]
+            if redirect:
+                kind = "redirect"
+                redirect = False
+            elif not expect_command:
+                kind = "argument"
+            elif text in _command_reserved:
+                kind = "reserved"
+            elif text in _other_reserved:
+                kind = "reserved"
+                expect_command = False
+            elif _assignment.match(text):
+                kind = "assignment"
+            else:
+                kind = "command"
+                command = k
+                expect_command = False
+            self.tokens[k] = Token(i, end, kind, parent, command)
+            i = end
+        return i
+
+    def _word(self, i: int, closer: Optional[str], k: int) -> int:
+        """Returns the end of the word at `i`, indexing the words of its substitutions as children of `k`."""
+        code = self.code
+        n = len(code)
+        start = i
+        while i < n:
+            m = _word_chars.match(code, i)
+            if m:
+                i = m.end()
+                continue
+            c = code[i]
+            if c == "\\":
+                i += 2
+            elif c == "'":
+                end = code.find("'", i + 1)
+                i = n if end < 0 else end + 1
+            elif c == '"':
+                i = self._double_quoted(i + 1, k)
+            elif c == "$":
+                i = self._dollar(i, k)
+            elif c == "`":
+                if closer == "`":
+                    break
+                i = self._commands(i + 1, "`", k)
+            elif c == "(" and i > start:  # glob qualifiers and arrays of assignments
+                i = self._skip_parens(i + 1)
+            else:
+                break
+        return min(i, n)
+
+    def _dollar(self, i: int, k: int) -> int:
+        code = self.code
+        if code.startswith("$((", i):
+            return self._skip_arithmetic(i + 3, 2)
+        if code.startswith("$(", i):
+            return self._commands(i + 2, ")", k)
+        if code.startswith("${", i):
+            return self._braces(i + 2, k)
+        if code.startswith("$'", i):
+            return _ansi_quoted.match(code, i + 2).end()
+        return i + 1
+
+    def _double_quoted(self, i: int, k: int) -> int:
+        code = self.code
+        n = len(code)
+        while i < n:
+            m = _double_quoted_chars.match(code, i)
+            if m:
+                i = m.end()
+                continue
+            c = code[i]
+            if c == '"':
+                return i + 1
+            if c == "\\":
+                i += 2
+            elif c == "$":
+                i = self._dollar(i, k)
+            else:
+                i = self._commands(i + 1, "`", k)
+        return n
+
+    def _braces(self, i: int, k: int) -> int:
+        code = self.code
+        n = len(code)
+        level = 1
+        while i < n:
+            m = _brace_chars.match(code, i)
+            if m:
+                i = m.end()
+                continue
+            c = code[i]
+            if c == "{":
+                level += 1
+                i += 1
+            elif c == "}":
+                level -= 1
+                i += 1
+                if level == 0:
+                    return i
+            elif c == "\\":
+                i += 2
+            elif c == "'":
+                end = code.find("'", i + 1)
+                i = n if end < 0 else end + 1
+            elif c == '"':
+                i = self._double_quoted(i + 1, k)
+            elif c == "$":
+                i = self._dollar(i, k)
+            else:
+                i = self._commands(i + 1, "`", k)
+        return n
+
+    def _skip_arithmetic(self, i: int, level: int) -> int:
+        code = self.code
+        n = len(code)
+        while i < n and level > 0:
+            c = code[i]
+            if c == "(":
+                level += 1
+            elif c == ")":
+                level -= 1
+            i += 1
+        return i
+
+    def _skip_parens(self, i: int) -> int:
+        return self._skip_arithmetic(i, 1)
+
+    def _skip_heredocs(self, i: int) -> int:
+        """Skips the bodies of the heredocs started on the line before `i`."""
+        code = self.code
+        n = len(code)
+        for (delimiter, strip_tabs) in self._heredocs:
+            while i < n:
+                end = code.find("\n", i)
+                end = n if end < 0 else end
+                line = code[i:end]
+                i = min(end + 1, n)
+                if (line.lstrip("\t") if strip_tabs else line) == delimiter:
+                    break
+        self._heredocs = []
+        return i
+
+def unquote(word: str) -> str:
+    """`word` without quotes and backslashes, as far as it can be known without expanding it."""
+    return re.sub(r"""\\(.)|['"]""", lambda m: m.group(1) or "", word)
@@ -0,0 +1,78 @@
+__all__ = ['LogWriter', 'SamplingFilter', 'start_logging']
+
+import logging
+import logging.handlers
+import queue
+from collections import defaultdict
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes every n-th record of a category, where n is 1 / `rates[category]`.
+    The category is given with `extra = {"category": ...}`. Records without one always pass.
+    """
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.every = {category: max(1, round(1 / rate)) if rate > 0 else 0 for (category, rate) in rates.items()}
+        self.seen: dict[str, int] = defaultdict(int)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, "category", None)
+        every = self.every.get(category, 1)
+        if every == 1:
+            return True
+        if every == 0:
+            return False
+        self.seen[category] += 1
+        return self.seen[category] % every == 1
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records as they are. The listener thread formats them,
+    so a record costs the caller only its creation.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class LogWriter:
+    """File-like object passing everything written to `logger` as records, e.g. for the pexpect logfile."""
+
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+
+    def write(self, data: str):
+        self.logger.debug("%s", data)
+
+    def flush(self):
+        pass
+
+def start_logging(
+        logger: logging.Logger, file_path: str, level: str, formatter: str,
+        pexpect_logger: logging.Logger, pexpect_file_path: str,
+        max_bytes: int, backup_count: int, sampling: dict[str, float],
+) -> logging.handlers.QueueListener:
+    """
+    Sends records of `logger` and `pexpect_logger` through a queue to a listener thread
+    which writes them to size-rotated files. Returns the started listener.
+    """
+    records = queue.SimpleQueue()
+    handler = LazyQueueHandler(records)
+    handler.addFilter(SamplingFilter(sampling))
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    pexpect_logger.setLevel(logging.DEBUG)
+    pexpect_logger.propagate = False
+    pexpect_logger.addHandler(LazyQueueHandler(records))
+
+    file_handler = logging.handlers.RotatingFileHandler(file_path,
+        maxBytes = max_bytes, backupCount = backup_count, delay = True)
+    file_handler.setFormatter(logging.Formatter(formatter))
+    file_handler.addFilter(lambda record: record.name != pexpect_logger.name)
+    pexpect_file_handler = logging.handlers.RotatingFileHandler(pexpect_file_path,
+        maxBytes = max_bytes, backupCount = backup_count, delay = True)
+    pexpect_file_handler.terminator = ""  # the data is written as it was read
+    pexpect_file_handler.addFilter(logging.Filter(pexpect_logger.name))
+    listener = logging.handlers.QueueListener(records, file_handler, pexpect_file_handler)
+    listener.start()
+    return listener
@@ -0,0 +1,122 @@
+__all__ = ['Histogram', 'Metrics', 'timed']
+
+import bisect
+import functools
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable
+
+class Histogram:
+    """Latency histogram with fixed buckets of upper bounds in seconds from 0.5 ms to about 1 min."""
+
+    bounds = [0.0005 * 2 ** i for i in range(18)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)  # the last one is unbounded
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the `q` quantile. inf when it is beyond the last bound."""
+        rank = q * self.count
+        seen = 0
+        for (bound, n) in zip(self.bounds + [float("inf")], self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Metrics:
+    """
+    Latency histograms and counters of the kernel.
+    Names are `<name>` or `<name>:<label value>` for counters partitioned by one label.
+    Safe to update from several threads.
+    """
+
+    def __init__(self, prefix: str = "zsh_jupyter_kernel"):
+        self.prefix = prefix
+        self.histograms: dict[str, Histogram] = defaultdict(Histogram)
+        self.counters: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            self.histograms[name].observe(seconds)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "histograms": {
+                    name: {
+                        "count": h.count,
+                        "sum": h.sum,
+                        "p50": h.quantile(0.5),
+                        "p99": h.quantile(0.99),
+                        "bounds": Histogram.bounds,
+                        "counts": list(h.counts),
+                    }
+                    for (name, h) in self.histograms.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+    def prometheus(self, labels: dict[str, str] = None) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        def format_labels(extra: dict) -> str:
+            items = {**(labels or {}), **extra}.items()
+            return "{" + ",".join(f'{k}="{v}"' for (k, v) in items) + "}" if items else ""
+
+        lines = []
+        with self._lock:
+            for (name, h) in sorted(self.histograms.items()):
+                metric = f"{self.prefix}_{name}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for (bound, n) in zip(Histogram.bounds + ["+Inf"], h.counts):
+                    cumulative += n
+                    lines.append(f"{metric}_bucket{format_labels({'le': str(bound)})} {cumulative}")
+                lines.append(f"{metric}_sum{format_labels({})} {h.sum}")
+                lines.append(f"{metric}_count{format_labels({})} {cumulative}")
+            typed = set()
+            for (key, n) in sorted(self.counters.items()):
+                (name, _, value) = key.partition(":")
+                metric = f"{self.prefix}_{name}_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{format_labels({'type': value} if value else {})} {n}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: Path, labels: dict[str, str] = None):
+        """Writes `path` for the textfile collector of the Prometheus node exporter."""
+        path.parent.mkdir(parents = True, exist_ok = True)
+        tmp = path.with_suffix(".tmp")  # the collector reads *.prom files only
+        tmp.write_text(self.prometheus(labels))
+        os.replace(tmp, path)
+
+def timed(name: str) -> Callable:
+    """Records the latency of a method of an object with `metrics` in the histogram `name`."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
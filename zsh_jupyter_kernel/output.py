@@ -0,0 +1,478 @@
+__all__ = ['OutputBudget', 'OutputCoalescer', 'PipeReader', 'ProgressCollapser', 'read_until']
+
+import codecs
+import os
+import re
+import secrets
+import select
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional, TextIO
+
+class OutputCoalescer:
+    """
+    Batches stream text into as few messages as possible while keeping output live.
+    Buffered text is sent once it reaches `maxsize` characters or once the oldest
+    buffered text is `interval` seconds old, whichever comes first.
+    Text of another stream flushes the buffer first so the order is kept.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, send: Callable[[str, str], None], maxsize: int, interval: float):
+        self.send = send
+        self.maxsize = maxsize
+        self.interval = interval
+        self._name: Optional[str] = None
+        self._chunks: list[str] = []
+        self._size = 0
+        self._since = 0.0
+        self._lock = threading.RLock()
+
+    def write(self, name: str, text: str):
+        if not text:
+            return
+        with self._lock:
+            if self._chunks and name != self._name:
+                self.flush()
+            if not self._chunks:
+                self._name = name
+                self._since = time.monotonic()
+            self._chunks.append(text)
+            self._size += len(text)
+            if self._size >= self.maxsize or self.timeout() == 0:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._chunks:
+                return
+            text = "".join(self._chunks)
+            self._chunks = []
+            self._size = 0
+            self.send(self._name, text)
+
+    def timeout(self) -> Optional[float]:
+        """Seconds until buffered text is due or None when nothing is buffered."""
+        if not self._chunks:
+            return None
+        return max(0.0, self._since + self.interval - time.monotonic())
+
+class OutputBudget:
+    """
+    Passes on at most `maxsize` characters of the output of a cell to `write`.
+    After that the whole output goes to a spill file in `spill_dir` and only its
+    last `tail_size` characters are kept to be passed on when the cell ends,
+    so memory use does not depend on how much a cell prints.
+    """
+
+    def __init__(self, write: Callable[[str, str], None], maxsize: int, tail_size: int, spill_dir: str):
+        self.write_through = write
+        self.maxsize = maxsize
+        self.tail_size = tail_size
+        self.spill_dir = Path(spill_dir)
+        self.spill_path: Optional[Path] = None
+        self._spill_file: Optional[TextIO] = None
+        self._spill_failed = False
+        self._name = "cell"
+        self._size = 0
+        self._head: list[str] = []  # to be written to the spill file once it is needed
+        self._tail: deque[tuple[str, str]] = deque()
+        self._tail_size = 0
+
+    def start(self, name: str):
+        """Starts the budget of a cell. `name` names its spill file."""
+        self.finish()
+        self._name = name
+        self._size = 0
+        self._spill_failed = False
+
+    def write(self, name: str, text: str):
+        room = self.maxsize - self._size
+        self._size += len(text)
+        if room > 0:
+            self.write_through(name, text[:room])
+            self._head.append(text[:room])
+            text = text[room:]
+            if not text:
+                return
+        if self._spill_file is None:
+            if self._spill_failed or not self._start_spilling():
+                return
+        self._spill_file.write(text)
+        self._tail.append((name, text))
+        self._tail_size += len(text)
+        while self._tail_size - len(self._tail[0][1]) >= self.tail_size:
+            self._tail_size -= len(self._tail.popleft()[1])
+
+    def allow(self, size: int) -> bool:
+        """
+        Counts `size` characters of a display of the cell against the budget if they fit.
+        Otherwise the display should not be sent and its text should be written instead.
+        """
+        if self._size + size > self.maxsize:
+            return False
+        self._size += size
+        return True
+
+    def finish(self):
+        """Passes on the tail of a spilled cell output."""
+        self._head = []
+        if self._spill_file is None:
+            return
+        self._spill_file.close()
+        self._spill_file = None
+        excess = self._tail_size - self.tail_size
+        if excess > 0:
+            (name, text) = self._tail[0]
+            self._tail[0] = (name, text[excess:])
+        self.write_through("stderr",
+            f"\n[output truncated: {self._size} characters in total, the first {self.maxsize}"
+            f" and the last {min(self._tail_size, self.tail_size)} are shown."
+            f" the full output is in {self.spill_path}]\n")
+        for (name, text) in self._tail:
+            self.write_through(name, text)
+        self._tail.clear()
+        self._tail_size = 0
+
+    def prune(self, ttl: float):
+        """Removes spill files older than `ttl` seconds."""
+        try:
+            for path in self.spill_dir.iterdir():
+                if time.time() - path.stat().st_mtime > ttl:
+                    path.unlink()
+        except OSError:
+            pass
+
+    def _start_spilling(self) -> bool:
+        try:
+            self.spill_dir.mkdir(parents = True, exist_ok = True)
+            self.spill_path = self.spill_dir / f"{self._name}.txt"
+            self._spill_file = open(self.spill_path, "w")
+        except OSError as e:
+            self._spill_failed = True
+            self.write_through("stderr", f"\n[output truncated: could not create a spill file: {e}]\n")
+            return False
+        self._spill_file.writelines(self._head)
+        self._head = []
+        self.write_through("stderr",
+            f"\n[output exceeds {self.maxsize} characters, writing it to {self.spill_path}]\n")
+        return True
+
+# controls rewriting text which was written already: a carriage return not ending a line and cursor up
+_redraw_re = re.compile(r"\r(?!\n)|\x1b\[\d*[AF]")
+_screen_re = re.compile(r"\r?\n|\r|\x1b\[([\d;?]*)([A-Za-z])")
+_partial_escape_re = re.compile(r"\x1b(\[[\d;?]*)?$")
+
+class _Screen:
+    """
+    Rows of text as a terminal shows them after carriage returns, cursor movements and erasing.
+    Lines `above` the first row, which were passed on already, become rows when the cursor moves up to them.
+    """
+
+    def __init__(self, above: list[str] = ()):
+        self.above = list(above)
+        self.rows: list[list[str]] = [[]]  # of cells, each a character with the escape sequences before it
+        self.row = 0
+        self.col = 0
+        self._attrs = ""  # escape sequences of the next character
+        self._partial = ""  # escape sequence split across writes
+
+    def feed(self, text: str):
+        text = self._partial + text
+        m = _partial_escape_re.search(text)
+        (text, self._partial) = (text[:m.start()], text[m.start():]) if m else (text, "")
+        i = 0
+        for m in _screen_re.finditer(text):
+            if m.start() > i:
+                self._put(text[i:m.start()])
+            i = m.end()
+            token = m.group()
+            if token[-1] == "\n":
+                self.row += 1
+                self.col = 0
+                if self.row == len(self.rows):
+                    self.rows.append([])
+            elif token == "\r":
+                self.col = 0
+            else:
+                self._control(*m.groups(), token)
+        if i < len(text):
+            self._put(text[i:])
+
+    def text(self) -> str:
+        return "\n".join("".join(row) for row in self.rows)
+
+    def size(self) -> int:
+        return sum(map(len, self.rows))
+
+    def width(self) -> int:
+        return max(map(len, self.rows))
+
+    def _put(self, run: str):
+        cells = list(run)
+        if self._attrs:
+            cells[0] = self._attrs + cells[0]
+            self._attrs = ""
+        row = self.rows[self.row]
+        if self.col > len(row):
+            row.extend(" " * (self.col - len(row)))
+        row[self.col:self.col + len(cells)] = cells
+        self.col += len(cells)
+
+    def _control(self, params: str, op: str, token: str):
+        n = int(params) if params.isdigit() else 0
+        row = self.rows[self.row]
+        if op in "AF":
+            self.row -= max(n, 1)
+            if self.row < 0 and self.above:
+                k = min(-self.row, len(self.above))
+                self.rows[:0] = [list(line) for line in self.above[-k:]]
+                del self.above[-k:]
+                self.row += k
+            self.row = max(0, self.row)
+        elif op in "BE":
+            self.row = min(len(self.rows) - 1, self.row + max(n, 1))
+        elif op == "G":
+            self.col = max(0, n - 1)
+        elif op == "K":
+            if n == 0:
+                del row[self.col:]
+            elif n == 1:
+                row[:self.col + 1] = " " * min(self.col + 1, len(row))
+            else:
+                row.clear()
+        elif op == "m":
+            self._attrs += token
+        if op in "EF":
+            self.col = 0
+
+class _Stream:
+    def __init__(self, name: str):
+        self.name = name
+        self.plain = False  # output is passed on unchanged until the end of the cell
+        self.tail = ""  # incomplete last line held back in case it is redrawn
+        self.recent: deque[str] = deque()  # last lines passed on, in case the cursor moves up to them
+        self.since = 0.0  # time.monotonic() of the oldest text in the tail
+        self.screen: Optional[_Screen] = None  # while redraws are collapsed
+        self.display_id: Optional[str] = None  # of the display showing the screen once it was sent
+        self.updated = 0.0  # time.monotonic() of the last update of the display
+        self.dirty = False
+
+class ProgressCollapser:
+    """
+    Collapses progress bars and other output redrawn with carriage returns and cursor movements
+    before it is written as stream text. Output is passed to `write` unchanged until a redraw.
+    From the start of its line the output is then kept as a terminal would show it and sent
+    to `display` as `(display id, text, update)` at most every `interval` seconds,
+    so the frontend receives the current state instead of every redraw.
+    After `maxrows` rows the display is final and output is passed on unchanged again.
+    Once the screen would be wider than `maxcols` or larger than `maxsize` characters or `display`
+    returns False, output is passed on unchanged until the cell finishes, so neither memory
+    nor the text sent with the updates grows with the length of the output.
+    Incomplete lines are held back for up to `interval` seconds in case they are redrawn.
+    """
+
+    def __init__(self, write: Callable[[str, str], None], display: Callable[[str, str, bool], Optional[bool]],
+            interval: float, maxrows: int, maxcols: int = 4096, maxsize: int = 1 << 16, maxtail: int = 1 << 16):
+        self.write_through = write
+        self.display = display
+        self.interval = interval
+        self.maxrows = maxrows
+        self.maxcols = maxcols
+        self.maxsize = maxsize
+        self.maxtail = maxtail
+        self._streams: dict[str, _Stream] = {}
+        self._prefix = secrets.token_hex(4)
+        self._displays = 0
+
+    def write(self, name: str, text: str):
+        stream = self._streams.get(name)
+        if stream is None:
+            stream = self._streams[name] = _Stream(name)
+        if stream.plain:
+            self.write_through(name, text)
+            return
+        if stream.screen is None:
+            text = stream.tail + text
+            m = _redraw_re.search(text)
+            if m and m.end() == len(text) and m.group() == "\r":
+                m = None  # may be the start of a line ending split across writes
+            if m is None:
+                end = text.rfind("\n") + 1
+                if len(text) - end > self.maxtail:
+                    end = len(text)
+                if end:
+                    self._write_through(name, stream, text[:end])
+                if not stream.tail or end:
+                    stream.since = time.monotonic()
+                stream.tail = text[end:]
+                return
+            start = text.rfind("\n", 0, m.start()) + 1
+            if start:
+                self._write_through(name, stream, text[:start])
+            (text, stream.tail) = (text[start:], "")
+            stream.screen = _Screen(stream.recent)
+            stream.recent.clear()
+        screen = stream.screen
+        if screen.size() + len(text) > self.maxsize:
+            self._end_screen(stream, screen.text())
+            self._fall_back(stream, text)
+            return
+        screen.feed(text)
+        stream.dirty = True
+        if screen.width() > self.maxcols:
+            self._end_screen(stream, screen.text())
+            self._fall_back(stream, "")
+        elif len(screen.rows) > self.maxrows and screen.row == len(screen.rows) - 1:
+            stream.tail = "".join(screen.rows.pop())  # the row at the cursor may still be written
+            stream.since = time.monotonic()
+            self._end_screen(stream, screen.text() + "\n")
+        elif time.monotonic() - stream.updated >= self.interval:
+            self._update(stream)
+
+    def timeout(self) -> Optional[float]:
+        """Seconds until held back text or an update is due or None when nothing is pending."""
+        due = [
+            (stream.updated if stream.screen is not None else stream.since) + self.interval
+            for stream in self._streams.values()
+            if stream.screen is not None and stream.dirty or stream.screen is None and stream.tail
+        ]
+        return max(0.0, min(due) - time.monotonic()) if due else None
+
+    def flush(self):
+        """Passes on what is due."""
+        now = time.monotonic()
+        for (name, stream) in self._streams.items():
+            if stream.screen is not None:
+                if stream.dirty and now - stream.updated >= self.interval:
+                    self._update(stream)
+            elif stream.tail and now - stream.since >= self.interval:
+                self.write_through(name, stream.tail)
+                stream.tail = ""
+
+    def finish(self):
+        """Passes on everything, e.g. at the end of a cell."""
+        for (name, stream) in self._streams.items():
+            if stream.screen is not None:
+                self._end_screen(stream, stream.screen.text())
+            if stream.tail:
+                self.write_through(name, stream.tail)
+                stream.tail = ""
+            stream.plain = False
+            stream.recent.clear()  # rows of this cell are not redrawn by the next one
+
+    def _write_through(self, name: str, stream: _Stream, text: str):
+        """Passes on complete lines."""
+        self.write_through(name, text)
+        lines = text.rsplit("\n", self.maxrows + 1)[:-1][-self.maxrows:]
+        stream.recent.extend(line[:-1] if line.endswith("\r") else line for line in lines)
+        while len(stream.recent) > self.maxrows:
+            stream.recent.popleft()
+
+    def _update(self, stream: _Stream, text: str = None):
+        update = stream.display_id is not None
+        if not update:
+            self._displays += 1
+            stream.display_id = f"{self._prefix}-{self._displays}"
+        if text is None:
+            text = stream.screen.text()
+        if self.display(stream.display_id, text, update) is False:
+            self._fall_back(stream, text)
+            return
+        stream.updated = time.monotonic()
+        stream.dirty = False
+
+    def _end_screen(self, stream: _Stream, text: str):
+        if stream.dirty or stream.display_id is None:
+            self._update(stream, text)
+        stream.screen = None
+        stream.display_id = None
+
+    def _fall_back(self, stream: _Stream, text: str):
+        """Passes on `text` and the rest of the output of the stream unchanged until the cell finishes."""
+        stream.plain = True
+        stream.screen = None
+        stream.display_id = None
+        (text, stream.tail) = (text + stream.tail, "")  # the row held back after `maxrows`
+        if text:
+            self.write_through(stream.name, text)
+
+class PipeReader(threading.Thread):
+    """
+    Reads a kernel-owned FIFO with large non-blocking reads while commands write
+    to it and passes the decoded text of stream `name` to `sink`.
+    """
+
+    def __init__(self, path: str, name: str, sink: Callable[[str, str], None],
+            encoding: str, errors: str, size: int = 1 << 16):
+        super().__init__(name = f"{name}-reader", daemon = True)
+        self.stream_name = name
+        self.sink = sink
+        self.size = size
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors = errors)
+        self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        # an own writer keeps the FIFO from signaling EOF whenever a command closes it
+        self._writer_fd = os.open(path, os.O_WRONLY)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._lock = threading.Lock()
+
+    def run(self):
+        while True:
+            readable, _, _ = select.select([self.fd, self._wakeup_r], [], [])
+            if self._wakeup_r in readable:
+                return
+            self.drain()
+
+    def drain(self):
+        """Passes on everything written so far."""
+        with self._lock:
+            while True:
+                try:
+                    data = os.read(self.fd, self.size)
+                except BlockingIOError:
+                    return
+                text = self.decoder.decode(data)
+                if text:
+                    self.sink(self.stream_name, text)
+
+    def close(self):
+        os.write(self._wakeup_w, b"\0")
+        self.join()
+        for fd in (self.fd, self._writer_fd, self._wakeup_r, self._wakeup_w):
+            os.close(fd)
+
+def read_until(read: Callable[[], str], patterns: list[re.Pattern], sink: Callable[[str], None],
+        chunk_size: int, window: int, text: str = "") -> tuple[int, re.Match, str, int]:
+    """
+    Reads text with `read`, starting with `text` read before, until one of `patterns` matches
+    and passes the text before the match to `sink`: complete lines as they are read and lines
+    longer than `chunk_size` in chunks, so memory is bounded by `chunk_size` instead of the length of a line.
+    Only new text and the `window` characters before it are searched, so reading stays linear
+    in the length of the output. `window` must be longer than a match and shorter than `chunk_size`.
+    Returns the index of the pattern matching first, its match, the text after it and the number of reads.
+    """
+    reads = 0
+    searched = 0  # characters of `text` searched already
+    while True:
+        start = max(0, searched - window)
+        first = None
+        for (i, pattern) in enumerate(patterns):
+            m = pattern.search(text, start)
+            if m is not None and (first is None or m.start() < first[1].start()):
+                first = (i, m)
+        if first is not None:
+            (i, m) = first
+            if m.start():
+                sink(text[:m.start()])
+            return (i, m, text[m.end():], reads)
+        end = text.rfind("\n", start) + 1
+        if len(text) - end > chunk_size:
+            end = len(text) - window  # the rest may be the start of a match
+        if end:
+            sink(text[:end])
+            text = text[end:]
+        searched = len(text)
+        text += read()
+        reads += 1
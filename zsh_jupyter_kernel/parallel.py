@@ -0,0 +1,168 @@
+__all__ = ['ParallelRun', 'parse_magic']
+
+import codecs
+import os
+import queue
+import re
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, Optional
+
+_magic_re = re.compile(r"%%parallel(?:[ \t]+-j[ \t]*(\d+))?(?:[ \t]+(.*))?[ \t]*$")
+
+def parse_magic(code: str) -> Optional[tuple[Optional[int], list[str]]]:
+    """
+    For a cell starting with `%%parallel [-j <jobs>] [<template>]` returns the number of jobs if given
+    and the commands: the lines of the cell or, with a template, the template for each line
+    with `{}` replaced by the quoted line or the quoted line appended. None for other cells.
+    Empty lines and comments are skipped.
+    """
+    (first, _, body) = code.partition("\n")
+    m = _magic_re.match(first)
+    if m is None:
+        return None
+    (jobs, template) = m.groups()
+    lines = [line for line in body.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+    if template:
+        if "{}" not in template:
+            template += " {}"
+        lines = [template.replace("{}", shlex.quote(line.strip())) for line in lines]
+    return (int(jobs) if jobs else None, lines)
+
+class ParallelRun:
+    """
+    Runs commands on up to `jobs` zsh processes in `cwd` with `env` and passes their output to `emit`
+    in the order of the commands, each line labeled with `[<index>] `. Output of the first unfinished
+    command is passed on as it is read, the output of the later ones once the commands before them finished.
+    A later command is read only until about `maxbuffer` characters of each of its streams are held,
+    after which it blocks on its full pipe until it becomes the first unfinished one,
+    so memory does not grow with the output of the later commands.
+    """
+
+    def __init__(self, cmds: list[str], jobs: int, cwd: str, env: dict[str, str],
+            encoding: str, errors: str, read_size: int = 1 << 16, maxbuffer: int = 1 << 20):
+        self.cmds = cmds
+        self.jobs = max(1, jobs)
+        self.cwd = cwd
+        self.env = env
+        self.encoding = encoding
+        self.errors = errors
+        self.read_size = read_size
+        self.maxbuffer = maxbuffer
+        self.procs: dict[int, subprocess.Popen] = {}  # of the running commands
+        self.results: list[Optional[dict]] = [None] * len(cmds)  # exit status and elapsed seconds of each command
+        self._events = queue.Queue()  # (index, stream name, text) and (index, None, exit status)
+        self._started: dict[int, float] = {}
+        self._buffers: dict[int, list[tuple[str, str]]] = {}  # output of later commands
+        self._at_line_start: dict[tuple[int, str], bool] = {}
+        self._open: dict[int, int] = {}  # streams of a command not read to the end yet
+        self._current: dict[int, threading.Event] = {}  # set once the output of a command is passed on as read
+        self._first = 0  # index of the first unfinished command
+
+    def run(self, emit: Callable[[str, str], None], deadline: float = None) -> bool:
+        """Returns False when the commands did not finish by the `deadline` as `time.monotonic()`."""
+        try:
+            pending = iter(range(len(self.cmds)))
+            for i in pending:
+                self._start(i)
+                if len(self.procs) == self.jobs:
+                    break
+            current = 0  # index of the command whose output is passed on as it is read
+            while current < len(self.cmds):
+                self._first = current
+                if current in self._current:
+                    self._current[current].set()
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    return False
+                try:
+                    (i, name, value) = self._events.get(timeout = timeout)
+                except queue.Empty:
+                    return False
+                if name is not None:
+                    if i == current:
+                        emit(name, self._label(i, name, value))
+                    else:
+                        self._buffers.setdefault(i, []).append((name, value))
+                    continue
+                self._open[i] -= 1
+                if self._open[i] > 0:
+                    continue
+                proc = self.procs.pop(i)
+                self.results[i] = {
+                    "exit_status": proc.wait(),
+                    "elapsed": time.monotonic() - self._started[i],
+                }
+                for j in pending:
+                    self._start(j)
+                    break
+                while current < len(self.cmds) and self.results[current] is not None:
+                    current += 1
+                    for (name, text) in self._buffers.pop(current, []):
+                        emit(name, self._label(current, name, text))
+            return True
+        finally:
+            self.kill()
+
+    def kill(self):
+        for event in self._current.values():
+            event.set()  # the readers of waiting commands read to the end of the killed ones
+        for proc in self.procs.values():
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            proc.wait()
+        self.procs = {}
+
+    def _start(self, i: int):
+        self._started[i] = time.monotonic()
+        proc = subprocess.Popen(
+            ["zsh", "-f", "-c", self.cmds[i]],
+            cwd = self.cwd,
+            env = self.env,
+            stdin = subprocess.DEVNULL,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.PIPE,
+            start_new_session = True,  # killed as a group, and interrupts of the kernel do not reach it
+        )
+        self.procs[i] = proc
+        self._open[i] = 2
+        self._current[i] = threading.Event()
+        if i <= self._first:
+            self._current[i].set()
+        for (name, pipe) in (("stdout", proc.stdout), ("stderr", proc.stderr)):
+            threading.Thread(target = self._read, args = (i, name, pipe),
+                name = f"parallel-{name}-reader", daemon = True).start()
+
+    def _read(self, i: int, name: str, pipe):
+        """Runs in a thread per stream of a command."""
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors = self.errors)
+        held = 0  # characters read before the command became the first unfinished one
+        with pipe:
+            while True:
+                data = pipe.read1(self.read_size)
+                text = decoder.decode(data, final = not data)
+                if text:
+                    self._events.put((i, name, text))
+                if not data:
+                    break
+                if not self._current[i].is_set():
+                    held += len(text)
+                    if held >= self.maxbuffer:
+                        self._current[i].wait()
+        self._events.put((i, None, None))
+
+    def _label(self, i: int, name: str, text: str) -> str:
+        label = f"[{i + 1}] "
+        labeled = text.replace("\n", "\n" + label)
+        if self._at_line_start.get((i, name), True):
+            labeled = label + labeled
+        at_line_start = text.endswith("\n")
+        if at_line_start:
+            labeled = labeled[:-len(label)]
+        self._at_line_start[(i, name)] = at_line_start
+        return labeled
@@ -0,0 +1,201 @@
+"""
+Pool of initialized shells for fast kernel starts and restarts.
+
+    python -m zsh_jupyter_kernel.pool [--size N] [--socket PATH] [--rcs]
+
+keeps `N` shells started and initialized like a kernel does it and hands them
+to kernels connecting to the Unix socket by passing the master end of their
+terminal. kernels use it when `ZSH_JUPYTER_KERNEL_POOL_SOCKET` is set to the
+same socket path and spawn their own shell when the pool does not answer.
+"""
+
+__all__ = ['PooledShell', 'ShellPool', 'sync_cmds', 'take_shell']
+
+import argparse
+import errno
+import fcntl
+import json
+import logging
+import os
+import pty
+import queue
+import re
+import secrets
+import shlex
+import signal
+import socket
+import struct
+import tempfile
+import termios
+import threading
+from typing import Optional
+
+from pexpect import EOF
+from pexpect.fdpexpect import fdspawn
+
+from .config import config
+
+class PooledShell(fdspawn):
+    """
+    A shell taken from a pool, driven through the master end of its terminal.
+    It is not a child of the kernel and hangs up when the kernel closes the terminal.
+    """
+
+    def __init__(self, fd: int, pid: int, **kwargs):
+        super().__init__(fd, **kwargs)
+        self.pid = pid
+
+    def sendintr(self):
+        self.send("\x03")  # the terminal turns it into SIGINT for the foreground process group
+
+    def read_nonblocking(self, size = 1, timeout = -1):
+        try:
+            return super().read_nonblocking(size, timeout)
+        except OSError as e:
+            if e.errno != errno.EIO:
+                raise
+            # the shell exited and closed its terminal
+            self.flag_eof = True
+            raise EOF("End Of File (EOF). Exception style platform.")
+
+def take_shell(path: str, timeout: float) -> Optional[tuple[int, int, dict]]:
+    """
+    Takes a shell from the pool at `path`.
+    Returns the master fd of its terminal, its pid and the environment it was started with
+    or None when the pool is not available.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(path)
+            (data, fds, _, _) = socket.recv_fds(s, 1 << 16, 1)
+            if not fds:
+                return None
+            chunks = [data]
+            while chunk := s.recv(1 << 16):
+                chunks.append(chunk)
+            header = json.loads(b"".join(chunks))
+            return (fds[0], header["pid"], header["env"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+def sync_cmds(cwd: str, env: dict, pool_env: dict) -> list[str]:
+    """
+    Commands moving a shell started in the environment `pool_env` into `cwd`
+    and exporting the variables which differ in `env`, so it behaves like a shell started by the kernel.
+    Variables changed by rc files of the pooled shell are kept unless the kernel has other values.
+    """
+    cmds = ["cd -q " + shlex.quote(cwd)]
+    for name in sorted(env.keys() | pool_env.keys()):
+        if name in ("PWD", "OLDPWD", "SHLVL", "_") or not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", name):
+            continue
+        if name not in env:
+            cmds.append(f"unset {name}")
+        elif env[name] != pool_env.get(name):
+            cmds.append(f"export {name}={shlex.quote(env[name])}")
+    return cmds
+
+class ShellPool:
+    """
+    Keeps up to `size` initialized shells and hands one to each client of the socket.
+    A replacement is started as soon as a shell was taken.
+    """
+
+    def __init__(self, size: int, args: list[str], init_cmds: list[str], log: logging.Logger):
+        self.args = args
+        # sourced from a file, as a line longer than the input limit of the terminal would be cut off
+        init_path = os.path.join(tempfile.mkdtemp(prefix = "zsh-jupyter-kernel-pool-"), "setup.zsh")
+        with open(init_path, "w") as f:
+            f.write("\n".join(init_cmds) + "\n")
+        self.init_line = ". " + shlex.quote(init_path)
+        self.log = log
+        self.shells: queue.Queue[tuple[int, int]] = queue.Queue(maxsize = size)
+
+    def _spawn(self) -> tuple[int, int]:
+        """Starts and initializes a shell. Returns its pid and the master fd of its terminal."""
+        (pid, fd) = pty.fork()
+        if pid == 0:
+            attributes = termios.tcgetattr(0)
+            attributes[3] &= ~termios.ECHO
+            termios.tcsetattr(0, termios.TCSANOW, attributes)
+            os.execvp("zsh", ["zsh", *self.args])
+        fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", 24, 80, 0, 0))
+        p = fdspawn(fd,
+            encoding = config["pexpect"]["encoding"],
+            codec_errors = config["pexpect"]["codec_errors"],
+            timeout = None,
+            maxread = config["pexpect"]["maxread"],
+            searchwindowsize = config["pexpect"]["searchwindowsize"],
+        )
+        nonce = secrets.token_hex(8)
+        p.sendline(f" __zsh_jupyter_kernel_nonce={nonce}; {self.init_line}")
+        p.expect(re.escape(nonce) + r":\d+:[\d,]*:[\d.]+;")
+        self.log.info("shell %s is ready", pid)
+        return (pid, fd)
+
+    def _fill(self):
+        while True:
+            try:
+                shell = self._spawn()
+            except (OSError, EOF) as e:
+                self.log.error("could not start a shell: %r", e)
+                threading.Event().wait(1)
+                continue
+            self.shells.put(shell)  # blocks while the pool is full
+
+    def _take(self) -> tuple[int, int]:
+        while True:
+            (pid, fd) = self.shells.get()
+            try:
+                os.kill(pid, 0)
+                return (pid, fd)
+            except ProcessLookupError:
+                self.log.warning("shell %s exited while waiting", pid)
+                os.close(fd)
+
+    def serve(self, path: str):
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # shells handed out are reaped automatically
+        threading.Thread(target = self._fill, name = "pool-filler", daemon = True).start()
+        if os.path.exists(path):
+            os.unlink(path)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            old_umask = os.umask(0o177)  # only the owner may take shells
+            try:
+                server.bind(path)
+            finally:
+                os.umask(old_umask)
+            server.listen()
+            self.log.info("serving %s", path)
+            while True:
+                (conn, _) = server.accept()
+                with conn:
+                    (pid, fd) = self._take()
+                    header = json.dumps({"pid": pid, "env": dict(os.environ)}).encode()
+                    try:
+                        socket.send_fds(conn, [header[:1]], [fd])
+                        conn.sendall(header[1:])
+                        self.log.info("handed out shell %s", pid)
+                    except OSError as e:
+                        self.log.error("could not hand out shell %s: %r", pid, e)
+                    finally:
+                        os.close(fd)
+
+def main():
+    from .kernel import ZshKernel  # not needed by kernels importing this module
+    parser = argparse.ArgumentParser(description = "pool of initialized shells for zsh kernels")
+    parser.add_argument("--size", type = int, default = 2, help = "shells kept ready. default: %(default)s")
+    parser.add_argument("--socket", default = config["zsh"]["pool"]["socket_path"],
+        required = config["zsh"]["pool"]["socket_path"] is None,
+        help = "default: $ZSH_JUPYTER_KERNEL_POOL_SOCKET")
+    parser.add_argument("--rcs", action = "store_true", help = "source zsh startup files in the shells")
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO, format = "%(asctime)s %(message)s")
+    pool = ShellPool(args.size,
+        args = ZshKernel.zsh_args(rcs = args.rcs),
+        init_cmds = ZshKernel.init_cmds(),
+        log = logging.getLogger("zsh-jupyter-kernel-pool"),
+    )
+    pool.serve(args.socket)
+
+if __name__ == "__main__":
+    main()
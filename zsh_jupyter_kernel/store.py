@@ -0,0 +1,117 @@
+__all__ = ['OutputStore']
+
+import gzip
+import os
+import zlib
+from collections import OrderedDict as odict
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+class OutputStore:
+    """
+    Stream output of executed cells by execution count, so later cells can read it
+    with the `out` helper of `helpers.zsh` instead of running the commands again.
+    Output is gzip-compressed as it is written. Entries are kept in memory within `maxbytes`
+    and the oldest ones are moved to `<dir>/<execution count>.gz`, so memory does not grow
+    with the length of the session. An entry larger than `maxbytes` is written there directly.
+    """
+
+    def __init__(self, dir: str, maxbytes: int, level: int = 1):
+        self.dir = Path(dir)
+        self.maxbytes = maxbytes
+        self.level = level
+        self.memory: odict[int, bytes] = odict()  # oldest first
+        self.nbytes = 0  # of the entries in memory
+        self._n: Optional[int] = None  # of the entry being written
+        self._compressor = None
+        self._chunks: list[bytes] = []
+        self._size = 0  # of the chunks
+        self._file: Optional[BinaryIO] = None  # of the entry being written once it is too large
+
+    def path(self, n: int) -> Path:
+        return self.dir / f"{n}.gz"
+
+    def start(self, n: int):
+        self.finish()
+        self._n = n
+        self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)  # 31 for the gzip format
+        self._chunks = []
+        self._size = 0
+
+    def write(self, text: str):
+        if self._compressor is None:
+            return
+        self._add(self._compressor.compress(text.encode("utf-8", "surrogateescape")))
+
+    def finish(self):
+        """Ends the entry being written. Finishing twice is harmless."""
+        if self._compressor is None:
+            return
+        self._add(self._compressor.flush())
+        if self._compressor is None:
+            return  # dropped
+        self._compressor = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.replace(self._tmp_path(self._n), self.path(self._n))
+        else:
+            self.memory[self._n] = b"".join(self._chunks)
+            self.nbytes += self._size
+            self._evict()
+        self._chunks = []
+
+    def read(self, n: int) -> Optional[bytes]:
+        """The output of the execution `n` or None if it was not stored or not finished yet."""
+        data = self.memory.get(n)
+        if data is None:
+            try:
+                data = self.path(n).read_bytes()
+            except OSError:
+                return None
+        return gzip.decompress(data)
+
+    def spill(self, n: int) -> Optional[Path]:
+        """Moves the entry `n` to disk, so it can be read as a file. None if there is no such entry."""
+        if n in self.memory:
+            self._move(n)
+        path = self.path(n)
+        return path if path.exists() else None
+
+    def _add(self, chunk: bytes):
+        if not chunk:
+            return
+        if self._file is None and self._size + len(chunk) > self.maxbytes:
+            try:
+                self.dir.mkdir(parents = True, exist_ok = True)
+                self._file = open(self._tmp_path(self._n), "wb")
+            except OSError:
+                # the entry is dropped rather than kept in memory beyond the budget
+                self._compressor = None
+                self._chunks = []
+                return
+            self._file.writelines(self._chunks)
+            self._chunks = []
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._chunks.append(chunk)
+        self._size += len(chunk)
+
+    def _evict(self):
+        while self.nbytes > self.maxbytes and self.memory:
+            n = next(iter(self.memory))
+            try:
+                self._move(n)
+            except OSError:
+                self.nbytes -= len(self.memory.pop(n))
+
+    def _move(self, n: int):
+        self.dir.mkdir(parents = True, exist_ok = True)
+        tmp = self._tmp_path(n)
+        tmp.write_bytes(self.memory[n])
+        os.replace(tmp, self.path(n))  # the shell never reads a partial file
+        self.nbytes -= len(self.memory.pop(n))
+
+    def _tmp_path(self, n: int) -> Path:
+        return self.dir / f"{n}.gz.tmp"
@@ -0,0 +1,60 @@
+__all__ = ['SyntaxChecker']
+
+import re
+
+from .worker import Worker
+
+class SyntaxChecker(Worker):
+    """
+    Resident syntax checker (see `check.zsh`) answering `is_complete_request`s
+    without spawning a shell per request.
+    """
+
+    # tokens which cannot be fixed by appending more code when the parser chokes on them
+    closers = {")", "}", ";;", ";&", ";|", "done", "fi", "esac", "]]", "))", "|", "||", "&&"}
+    # tokens after which the next line is indented one level deeper
+    openers = ("do", "then", "else", "{", "(", "in", "|", "||", "&&", "\\")
+    indent_unit = "    "
+
+    def is_complete(self, code: str) -> dict:
+        errors = self.request(code.encode())
+        if errors is None:
+            return {"status": "unknown"}
+        status = self.classify(code, errors.decode(errors = "replace"))
+        if status == "incomplete":
+            return {"status": status, "indent": self.indent(code)}
+        return {"status": status}
+
+    @classmethod
+    def classify(cls, code: str, errors: str) -> str:
+        """
+        Maps parser `errors` for `code` to an `is_complete_reply` status.
+        Code is incomplete when the parser ran out of input, that is when it
+        failed at the very end of the code on a token which more code can follow.
+        """
+        if not errors.strip():
+            return "complete"
+        if re.search(r"unmatched|end of file|parse error$|parse error near `\n?'", errors, re.M):
+            return "incomplete"
+        near = re.search(r"parse error near `(.*)'", errors)
+        if near:
+            # the parser quotes the rest of the line from where it failed,
+            # truncated to 20 characters followed by "..."
+            rest = near.group(1)
+            code = code.rstrip()
+            if rest.endswith("..."):
+                at_end = rest[:-3] in code.rsplit("\n", 1)[-1]
+            else:
+                at_end = code.endswith(rest)
+            if at_end and rest not in cls.closers:
+                return "incomplete"
+        return "invalid"
+
+    @classmethod
+    def indent(cls, code: str) -> str:
+        """Indentation hint for the line following incomplete `code`."""
+        last = code.rstrip("\n").rsplit("\n", 1)[-1]
+        indent = last[:len(last) - len(last.lstrip())]
+        if last.rstrip().endswith(cls.openers):
+            indent += cls.indent_unit
+        return indent
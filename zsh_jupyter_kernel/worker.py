@@ -0,0 +1,104 @@
+__all__ = ['Worker']
+
+import os
+import select
+import subprocess
+import time
+from typing import Optional
+
+class Worker:
+    """
+    Long-lived zsh helper process answering requests over its stdin and stdout.
+    Both directions are framed as `<n>\\n` followed by `n` bytes.
+    The script prints a `ready` line once it has initialized.
+    A worker which died or stopped responding is restarted on the next request.
+    """
+
+    proc: Optional[subprocess.Popen] = None
+
+    def __init__(self, script: str, start_timeout: float, timeout: float, log = None):
+        self.script = script
+        self.start_timeout = start_timeout
+        self.timeout = timeout
+        self.log = log
+        self._buffer = b""
+        self._ready = False
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        """Spawns the worker without waiting for it to become ready."""
+        self.stop()
+        self.proc = subprocess.Popen(
+            # sourced rather than run, as zsh reads the zcompiled copy of a script only then
+            ["zsh", "-f", "-c", '. "$0"', self.script],
+            stdin = subprocess.PIPE,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.DEVNULL,
+            start_new_session = True,  # interrupts sent to the kernel must not reach the worker
+        )
+        self._buffer = b""
+        self._ready = False
+        if self.log:
+            self.log.debug("started %s %s", self.script, self.proc.pid)
+
+    def stop(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.kill()
+            self.proc.wait()
+        except OSError:
+            pass
+        for f in (self.proc.stdin, self.proc.stdout):
+            try:
+                f.close()
+            except OSError:
+                pass
+        self.proc = None
+
+    def request(self, payload: bytes) -> Optional[bytes]:
+        """Returns the reply to `payload` or None if the worker failed twice."""
+        for attempt in range(2):
+            if not self.alive:
+                self.start()
+            try:
+                if not self._ready:
+                    self._readline(time.monotonic() + self.start_timeout)
+                    self._ready = True
+                self.proc.stdin.write(b"%d\n" % len(payload) + payload)
+                self.proc.stdin.flush()
+                deadline = time.monotonic() + self.timeout
+                n = int(self._readline(deadline))
+                return self._read(n, deadline)
+            except (OSError, EOFError, TimeoutError, ValueError) as e:
+                if self.log:
+                    self.log.debug("%s failed (attempt %s): %r", self.script, attempt, e)
+                self.stop()
+        return None
+
+    def _fill(self, deadline: float):
+        fd = self.proc.stdout.fileno()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"{self.script} did not respond")
+        readable, _, _ = select.select([fd], [], [], remaining)
+        if readable:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise EOFError(f"{self.script} exited")
+            self._buffer += chunk
+
+    def _readline(self, deadline: float) -> bytes:
+        while b"\n" not in self._buffer:
+            self._fill(deadline)
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line
+
+    def _read(self, n: int, deadline: float) -> bytes:
+        while len(self._buffer) < n:
+            self._fill(deadline)
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
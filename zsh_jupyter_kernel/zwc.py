@@ -0,0 +1,52 @@
+__all__ = ['compile_scripts', 'compiled']
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+_dirs: dict[Path, Path] = {}  # script directory -> directory of its compiled copies
+
+def compile_scripts(src_dir: Path, cache_dir: Path, timeout: float = 30) -> Path:
+    """
+    Directory with copies of the zsh scripts of `src_dir` next to their `zcompile`d `.zwc` files,
+    which zsh reads instead of parsing the scripts when they are sourced with `.` or `source`,
+    though not when they are run as `zsh <script>`.
+    It is built once per content of the scripts in a temporary directory which is then renamed
+    into place, so concurrent kernels never use a partial one.
+    Returns `src_dir` when the scripts cannot be compiled.
+    """
+    scripts = sorted(src_dir.glob("*.zsh"))
+    digest = hashlib.sha256()
+    for path in scripts:
+        digest.update(path.name.encode() + b"\0" + path.read_bytes() + b"\0")
+    target = cache_dir / digest.hexdigest()[:16]
+    if target.is_dir():
+        return target
+    tmp = None
+    try:
+        cache_dir.mkdir(parents = True, exist_ok = True)
+        tmp = Path(tempfile.mkdtemp(prefix = "tmp-", dir = cache_dir))
+        for path in scripts:
+            shutil.copy2(path, tmp)  # keeps the executable bit of capture.zsh
+        # compiled after copying, so the .zwc files are newer than the scripts as zsh requires
+        subprocess.run(["zsh", "-fc", "for f; zcompile -- $f", "zsh", *(p.name for p in scripts)],
+            cwd = tmp, check = True, timeout = timeout,
+            stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        os.rename(tmp, target)
+        tmp = None
+    except (OSError, subprocess.SubprocessError):
+        pass  # e.g. another kernel renamed its directory first
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors = True)
+    return target if target.is_dir() else src_dir
+
+def compiled(path: str, cache_dir: str) -> str:
+    """Path of the compiled copy of the script at `path`. The scripts of its directory are compiled once."""
+    path = Path(path)
+    if path.parent not in _dirs:
+        _dirs[path.parent] = compile_scripts(path.parent, Path(cache_dir))
+    return str(_dirs[path.parent] / path.name)